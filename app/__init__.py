@@ -1,18 +1,49 @@
-from urllib.parse import quote
+import os
 from flask import Flask
 from flask_babelex import Babel
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from app.database import database_config, RoutingSession, init_routing
 
 
 app = Flask(__name__)
 
 app.secret_key = '$%^*&())(*&%^%4678675446&#%$%^&&*^$&%&*^&^'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://root:%s@localhost/project_btl?charset=utf8mb4' % quote('phantan0106')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+# cấu hình CSDL lấy từ biến môi trường, xem app/database.py (DATABASE_URL, DB_ENGINE=sqlite, DB_POOL_*...)
+app.config.update(database_config())
+# độ trễ sao chép tối đa của bản sao; trong khoảng này người vừa ghi sẽ đọc từ CSDL chính
+app.config['REPLICA_STICKY_SECONDS'] = 5
+app.config['CART_KEY'] = 'cart'
+app.config['CACHE_BACKEND'] = 'lru'  # 'shared': dùng CACHE_REDIS_URL, bỏ trống thì dùng bộ nhớ cục bộ
+app.config['CACHE_LRU_SIZE'] = 512
+app.config['CACHE_REDIS_URL'] = None
+app.config['FLIGHT_PAGE_SIZE'] = 20
+app.config['FLIGHT_PAGE_SIZE_MAX'] = 100
+# số câu SQL tối đa cho mỗi trang (khách chưa đăng nhập), kiểm tra bằng: python -m app.jobs budgets
+app.config['SQL_QUERY_BUDGETS'] = {
+    '/': 1,
+    '/booking': 2,
+    '/search_booking': 3,
+    '/api/search_booking': 2,
+    '/flight/<flight_id>': 3
+}
+app.config['PASSWORD_HASHER'] = 'scrypt'  # hoặc 'pbkdf2_sha256'
+# (số lần thử, số giây để hồi đầy) cho mỗi tên đăng nhập và mỗi địa chỉ IP
+# thử tải từ một máy (python -m app.loadtest) thì nới giới hạn IP, vd: LOGIN_THROTTLE_IP=100000,1
+app.config['LOGIN_THROTTLE_USER'] = (5, 300)
+app.config['LOGIN_THROTTLE_IP'] = tuple(int(v) for v in os.environ.get('LOGIN_THROTTLE_IP', '30,300').split(','))
+# bộ nhớ đệm người dùng cho user_loader: thời hạn (giây) và số mục tối đa
+app.config['USER_CACHE_TTL'] = 60
+app.config['USER_CACHE_SIZE'] = 10000
+# giữ chỗ: số giây giữ ghế trong giỏ vé, chu kỳ (giây) của luồng trả ghế hết hạn (0: tắt, dùng python -m app.jobs holds)
+app.config['HOLD_TTL'] = 900
+app.config['HOLD_SWEEP_INTERVAL'] = 30
+# câu SQL chạy lâu hơn (giây) sẽ ghi vào nhật ký câu chậm, xem /metrics (quản trị viên)
+app.config['SLOW_QUERY_SECONDS'] = 0.2
 babel = Babel(app)
 
-db = SQLAlchemy(app=app)
+db = SQLAlchemy(app=app, session_options={'class_': RoutingSession})
+init_routing(app, db)
 
 login = LoginManager(app=app)
 
@@ -1,6 +1,6 @@
 from decimal import Decimal
 
-from flask import redirect, url_for, request, flash
+from flask import redirect, url_for, request, flash, jsonify
 from flask_admin import Admin, expose, BaseView
 from flask_admin.babel import gettext, ngettext
 from flask_admin.helpers import get_redirect_target, flash_errors
@@ -10,7 +10,8 @@ from flask_wtf import FlaskForm
 from wtforms import SelectField, StringField, DateTimeLocalField
 from wtforms.validators import InputRequired, Length
 
-from app import dao, controller
+from app import dao, controller, importer, exports
+from app.cache import response_cache
 
 from app.models import *
 from flask_admin.contrib.sqla import ModelView
@@ -23,9 +24,33 @@ class Base_View(ModelView):
     column_display_pk = True
     can_view_details = True
     can_export = True
+    export_types = ['csv', 'xlsx']
     # edit_modal = True
     page_size = 10
 
+    def _export_data(self):
+        # khong thuc thi truy van o day: doc theo lo bang con tro phia may chu khi dang gui file
+        view_args = self._get_list_extra_args()
+        sort_column = self._get_column_by_idx(view_args.sort)
+        if sort_column is not None:
+            sort_column = sort_column[0]
+        count, query = self.get_list(0, sort_column, view_args.sort_desc, view_args.search, view_args.filters,
+                                     execute=False, page_size=self.export_max_rows)
+        return count, exports.iterate(query)
+
+    def _export_stream(self, export_type):
+        count, data = self._export_data()
+        titles = [c[1] for c in self._export_columns]
+        rows = ([self.get_export_value(row, c[0]) for c in self._export_columns] for row in data)
+        return exports.stream_export(self.get_export_name(export_type).rsplit('.', 1)[0], titles, rows,
+                                     export_type, total=count)
+
+    def _export_csv(self, return_url):
+        return self._export_stream('csv')
+
+    def _export_tablib(self, export_type, return_url):
+        return self._export_stream(export_type)
+
 
 class AuthenticatedFlight(Base_View):
     def is_accessible(self):
@@ -57,6 +82,20 @@ class RegulationView(AuthenticatedModelView):
         'description': 'Mô tả'
     }
 
+    def after_model_change(self, form, model, is_created):
+        dao.regulation_cache.invalidate()
+        self.refresh_sale_windows(model)
+
+    def after_model_delete(self, model):
+        dao.regulation_cache.invalidate()
+        self.refresh_sale_windows(model)
+
+    def refresh_sale_windows(self, model):
+        if model.name in [r for c, r in dao.SALE_CHANNELS.values()]:
+            dao.refresh_sale_windows()
+            db.session.commit()
+            response_cache.invalidate('flights')
+
 
 class FlightForm(FlaskForm):
     id = StringField(name="id", validators=[InputRequired(), Length(max=10)])
@@ -81,6 +120,10 @@ class FlightManagementView(AuthenticatedFlight):
         'airlines': 'Tuyến bay'
     }
 
+    def get_one(self, id):
+        # ban ghi sap sua nen doc tu CSDL chinh, khong qua ban sao
+        return dao.flight_query('admin-edit').get(id)
+
     @expose('/new/', methods=('GET', 'POST'))
     def create_view(self):
         return_url = get_redirect_target() or self.get_url('.index_view')
@@ -173,147 +216,94 @@ class FlightManagementView(AuthenticatedFlight):
             flash(gettext('Record does not exist.'), 'error')
             return redirect(return_url)
 
-        old_model = model
-        old_airline = old_model.airlines.name
         form = FlightForm(obj=model)
-        medium_list = []
+        airlines = {a.name: a for a in AirLine.query.all()}
+        airports = dao.load_airports()
 
         form.planes.choices = [p.id for p in AirPlane.query.all()]
-        form.airlines.choices = [a.name for a in AirLine.query.all()]
-
-        for apm in dao.get_apm_by_flight_id(id):
-            medium_list.append(apm)
+        form.airlines.choices = list(airlines.keys())
 
+        medium_list = dao.get_apm_by_flight_id(id)
         medium_num = len(medium_list)
 
         fl_reg = [5]
         stop_reg = [6, 7]
 
         if request.method == "POST":
-            f_id = form.id.data
-            name = form.name.data
-            departing_at = form.departing_at.data
-            arriving_at = form.arriving_at.data
-            plane = form.planes.data
-            airline = form.airlines.data
-
-            sts_msg = 'success'
-
-            if departing_at != model.departing_at or arriving_at != model.arriving_at:
-                sts_msg = dao.check_time_flight(departing_at, arriving_at, fl_reg[0])
-
-            if plane != model.plane_id:
-                sts_msg = dao.check_plane_in_flight(departing_at, arriving_at, plane)
-
-            if f_id != model.id and Flight.query.filter(Flight.id.__eq__(f_id.strip())).first():
-                sts_msg = "Mã chuyến bay đã tồn tại! Vui lòng đổi sang nội dung khác!"
-
-            if sts_msg == 'success':
-                try:
-                    dao.update_flight(model, f_id, name, departing_at, arriving_at, plane, airline)
-                except:
-                    sts_msg = 'Đã có lỗi xảy ra khi cập nhật chuyến bay! Vui lòng quay lại sau!'
-
-                medium_list = []
-                for apm in dao.get_apm_by_flight_id(model.id):
-                    medium_list.append(apm)
-                medium_num = len(medium_list)
-
-                if medium_num > 0:
-                    for i in range(medium_num):
-                        str_del_am = "del-" + str(i)
-
-                        if str_del_am in request.form:
-                            dao.del_apm(medium_list[i].flight_id, medium_list[i].airport_medium_id)
-                            return redirect(self.get_url('.edit_view', id=self.get_pk_value(model)))
-                        else:
-                            str_edit_name = "ns-" + str(i)
-                            str_edit_stb = "stb-" + str(i)
-                            str_edit_stf = "stf-" + str(i)
-                            str_edit_des = "d-" + str(i)
-                            str_edit_ap = "form-edit-select-" + str(i)
-                            am_edit_name = request.form[str_edit_name]
-                            am_edit_stb = datetime.strptime(request.form[str_edit_stb], "%Y-%m-%dT%H:%M")
-                            am_edit_stf = datetime.strptime(request.form[str_edit_stf], "%Y-%m-%dT%H:%M")
-                            am_edit_des = request.form[str_edit_des]
-                            am_edit_ap = request.form[str_edit_ap]
-
-                            am_edit_msg = 'success'
-
-                            if am_edit_stb != medium_list[i].stop_time_begin or \
-                                    am_edit_stf != medium_list[i].stop_time_finish:
-                                am_edit_msg = dao.check_time_stop(am_edit_stb, am_edit_stf, model.id, stop_reg)
-
-                            if am_edit_ap != medium_list[i].airports.name or airline != old_airline:
-                                am_edit_msg = dao.check_airport_in_medium(airline, am_edit_ap, model.id)
-
-                            if am_edit_msg == 'success':
-                                try:
-                                    dao.update_apm(
-                                        medium_list[i], am_edit_name, am_edit_stb,
-                                        am_edit_stf, am_edit_des, f_id, am_edit_ap
-                                    )
-                                except:
-                                    dao.update_flight(model, old_model.id, old_model.name,
-                                                      old_model.departing_at, old_model.arriving_at,
-                                                      old_model.plane_id, old_airline)
-                                    am_edit_msg = 'Đã có lỗi xảy ra khi cập nhật trạm dừng! Vui lòng quay lại sau!'
-                            else:
-                                try:
-                                    dao.update_flight(model, old_model.id, old_model.name,
-                                                      old_model.departing_at, old_model.arriving_at,
-                                                      old_model.plane_id, old_airline)
-                                except:
-                                    sts_msg = 'Đã có lỗi xảy ra khi cập nhật chuyến bay! Vui lòng quay lại sau!'
-                                am_edit_msg = am_edit_msg
-
-                if 'isMedium' in request.form:
-                    if 'number' in request.form:
-                        num = int(request.form['number'])
-                        for i in range(num):
-                            str_name = "name-stop-" + str(i)
-                            str_stb = "stop-time-begin-" + str(i)
-                            str_stf = "stop-time-finish-" + str(i)
-                            str_des = "description-" + str(i)
-                            str_ap = "form-select-" + str(i)
-
-                            am_name = request.form[str_name]
-                            am_stb = datetime.strptime(request.form[str_stb], "%Y-%m-%dT%H:%M")
-                            am_stf = datetime.strptime(request.form[str_stf], "%Y-%m-%dT%H:%M")
-                            am_des = request.form[str_des]
-                            am_ap = request.form[str_ap]
-                            am_msg = dao.check_stop_station(am_name, am_stb, am_stf, airline,
-                                                            am_ap, model.id, stop_reg)
-                            if am_msg == 'success':
-                                try:
-                                    dao.save_airport_medium(am_name, am_stb,
-                                                            am_stf, am_des,
-                                                            model.id, am_ap, stop_reg)
-                                except:
-                                    dao.update_flight(model, old_model.id, old_model.name,
-                                                      old_model.departing_at, old_model.arriving_at,
-                                                      old_model.plane_id, old_airline)
-                                    am_msg = 'Đã có lỗi xảy ra khi lưu trạm dừng! Vui lòng quay lại sau!'
-                            else:
-                                dao.update_flight(model, old_model.id, old_model.name,
-                                                  old_model.departing_at, old_model.arriving_at,
-                                                  old_model.plane_id, old_airline)
-                                am_msg = am_msg
+            for i in range(medium_num):
+                if "del-" + str(i) in request.form:
+                    dao.del_apm(medium_list[i].flight_id, medium_list[i].airport_medium_id)
+                    return redirect(self.get_url('.edit_view', id=self.get_pk_value(model)))
+
+            flight = {
+                'id': form.id.data,
+                'name': form.name.data,
+                'departing_at': form.departing_at.data,
+                'arriving_at': form.arriving_at.data,
+                'plane': form.planes.data,
+                'airline': form.airlines.data
+            }
+
+            edits = []
+            for i in range(medium_num):
+                edits.append((medium_list[i], {
+                    'name': request.form["ns-" + str(i)],
+                    'begin': datetime.strptime(request.form["stb-" + str(i)], "%Y-%m-%dT%H:%M"),
+                    'finish': datetime.strptime(request.form["stf-" + str(i)], "%Y-%m-%dT%H:%M"),
+                    'description': request.form["d-" + str(i)],
+                    'airport': request.form["form-edit-select-" + str(i)]
+                }))
+
+            new_stops = []
+            if 'isMedium' in request.form and 'number' in request.form:
+                for i in range(int(request.form['number'])):
+                    new_stops.append({
+                        'name': request.form["name-stop-" + str(i)],
+                        'begin': datetime.strptime(request.form["stop-time-begin-" + str(i)], "%Y-%m-%dT%H:%M"),
+                        'finish': datetime.strptime(request.form["stop-time-finish-" + str(i)], "%Y-%m-%dT%H:%M"),
+                        'description': request.form["description-" + str(i)],
+                        'airport': request.form["form-select-" + str(i)]
+                    })
+
+            sts_msg, am_edit_msg, am_msg = dao.edit_flight(model, flight, edits, new_stops,
+                                                           airlines, {a.name: a for a in airports},
+                                                           fl_reg, stop_reg)
 
             if sts_msg == 'success':
                 if am_edit_msg == 'success' or am_edit_msg == '':
                     if am_msg == 'success' or am_msg == '':
                         flash(gettext('Record was successfully saved.'), 'success')
-                        return redirect(self.get_url('.details_view', id=model.id, url=return_url))
+                        return redirect(self.get_url('.details_view', id=flight['id'], url=return_url))
 
         if request.method == 'GET' or form.errors:
             self.on_form_prefill(form, model.id)
 
         return self.render('admin/flight-edit.html', form=form, model=model,
-                           medium_num=medium_num, airports=dao.load_airports(),
+                           medium_num=medium_num, airports=airports,
                            sts_msg=sts_msg, medium_list=medium_list,
                            am_msg=am_msg, am_edit_msg=am_edit_msg, return_url=return_url)
 
+    @expose('/import/', methods=('GET', 'POST'))
+    def import_view(self):
+        return_url = get_redirect_target() or self.get_url('.index_view')
+
+        if not self.can_create:
+            return redirect(return_url)
+
+        report = None
+        if request.method == 'POST' and 'file' in request.files:
+            f = request.files['file']
+            format = f.filename.rsplit('.', 1)[-1].lower()
+            if format in ('csv', 'json', 'jsonl'):
+                report = importer.import_schedule(f.stream, format)
+            else:
+                flash('Chỉ hỗ trợ tệp .csv, .json hoặc .jsonl', 'error')
+
+            if report and request.args.get('format') == 'json':
+                return jsonify(report)
+
+        return self.render('admin/flight-import.html', report=report, return_url=return_url)
+
     @expose('/details/')
     def details_view(self):
         return_url = get_redirect_target() or self.get_url('.index_view')
@@ -343,20 +333,58 @@ class FlightManagementView(AuthenticatedFlight):
                            return_url=return_url)
 
 
+EXPORTS = {
+    'revenue': (['Ngày', 'Mã tuyến bay', 'Tên tuyến bay', 'Mã chuyến bay', 'Số vé', 'Doanh thu'],
+                dao.revenue_export_statement),
+    'tickets': (['Mã vé', 'Mã đặt chỗ', 'Ngày bán', 'Mã chuyến bay', 'Tên chuyến bay', 'Tuyến bay', 'Ghế', 'Hạng vé',
+                 'Giá vé', 'Hành khách', 'CMND/CCCD', 'Email', 'Số điện thoại'],
+                dao.tickets_export_statement)
+}
+
+
 class StatsView(AuthenticatedView):
     @expose('/')
     def index(self):
         total = Decimal(0)
         airline_name = request.args.get('airline_name')
         date = request.args.get('month')
-        statistics = dao.statistic_revenue_follow_month(airline_name=airline_name,
-                                                        date=date)
+        from_date = request.args.get('from_date')
+        to_date = request.args.get('to_date')
+        if from_date or to_date:
+            statistics = dao.statistic_revenue(airline_name=airline_name,
+                                               from_date=from_date and datetime.strptime(from_date, "%Y-%m-%d").date(),
+                                               to_date=to_date and datetime.strptime(to_date, "%Y-%m-%d").date())
+        else:
+            statistics = dao.statistic_revenue_follow_month(airline_name=airline_name,
+                                                            date=date)
         for s in statistics:
             if s[2]:
                 total = total + s[2]
         return self.render('admin/stats.html',
                            statistics=statistics, total=total)
 
+    @expose('/export/<kind>/<export_type>/')
+    def export(self, kind, export_type):
+        # doanh thu theo ngay/chuyen bay hoac danh sach ve, cung bo loc voi trang thong ke
+        if kind not in EXPORTS or export_type not in exports.WRITERS:
+            return redirect(url_for('.index'))
+        airline_name = request.args.get('airline_name')
+        from_date = controller.parse_date(request.args.get('from_date'))
+        to_date = controller.parse_date(request.args.get('to_date'))
+        month = request.args.get('month')
+        if month and not (from_date or to_date):
+            try:
+                from_date = datetime.strptime(month, "%Y-%m").date()
+            except ValueError:
+                return redirect(url_for('.index'))
+            to_date = datetime(from_date.year + from_date.month // 12, from_date.month % 12 + 1, 1).date() \
+                - timedelta(days=1)
+
+        titles, statement = EXPORTS[kind]
+        rows = exports.iterate(statement(airline_name=airline_name, from_date=from_date, to_date=to_date))
+        return exports.stream_export('%s_%s' % (kind, datetime.now().strftime('%Y-%m-%d_%H-%M-%S')),
+                                     titles, rows, export_type)
+
 
 class LogoutView(AuthenticatedView):
     @expose('/')
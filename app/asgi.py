@@ -0,0 +1,339 @@
+import asyncio
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs
+from app import app, db, dao
+from app.controller import parse_date
+from app.database import async_database_url, async_engine_options
+from app.models import AirPort, Flight
+
+
+# API JSON chi doc (tim chuyen bay, san bay, ghe trong, chi tiet chuyen bay) chay bat dong bo,
+# cac duong dan con lai chuyen cho ung dung Flask. Can them driver async va may chu ASGI, vd:
+#   pip install uvicorn aiomysql      (DB_ENGINE=sqlite: aiosqlite)
+#   uvicorn app.asgi:application --workers 2
+API_PREFIX = '/api/v2'
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        self.status = status
+        self.message = message
+
+
+async def search(session, params):
+    page_size = int_param(params, 'page_size') or app.config['FLIGHT_PAGE_SIZE']
+    page_size = max(1, min(page_size, app.config['FLIGHT_PAGE_SIZE_MAX']))
+    # API cong khai, khong co phien dang nhap nen luon theo han dat ve cua khach
+    query = dao.search_flights_statement(from_airport_id=int_param(params, 'from_airport_id'),
+                                         to_airport_id=int_param(params, 'to_airport_id'),
+                                         date_from=parse_date(params.get('date_from')),
+                                         date_to=parse_date(params.get('date_to')),
+                                         kw=params.get('kw'),
+                                         cursor=params.get('cursor'),
+                                         page_size=page_size,
+                                         channel='customer')
+    flights, next_cursor = dao.flight_page((await session.execute(query)).scalars().all(), page_size)
+    availability = await load_availability(session, [f.id for f in flights])
+
+    return {
+        'flights': [{
+            'id': f.id,
+            'name': f.name,
+            'departing_at': f.departing_at,
+            'arriving_at': f.arriving_at,
+            'plane_id': f.plane_id,
+            'airlines': {
+                'name': f.airlines.name
+            },
+            'available': sum(availability.get(f.id, {}).values()),
+            'available_by_rank': availability.get(f.id, {})
+        } for f in flights],
+        'next_cursor': next_cursor
+    }
+
+
+async def airports(session, params):
+    rows = (await session.execute(db.select(AirPort.id, AirPort.name).order_by(AirPort.id))).all()
+    return [{'id': a.id, 'name': a.name} for a in rows]
+
+
+async def availability(session, params):
+    ids = [i for i in (params.get('ids') or '').split(',') if i][:app.config['FLIGHT_PAGE_SIZE_MAX']]
+    return await load_availability(session, ids)
+
+
+async def seat_map(session, params, flight_id):
+    return dao.seat_map_data((await session.execute(dao.seat_map_statement(flight_id))).all())
+
+
+async def flight_detail(session, params, flight_id):
+    query = db.select(Flight).options(*dao.QUERY_PROFILES['api-detail']).where(Flight.id.__eq__(flight_id))
+    f = (await session.execute(query)).scalars().first()
+    if f is None:
+        raise ApiError(404, 'Chuyến bay không tồn tại')
+    stops = (await session.execute(dao.stops_statement(flight_id))).scalars().all()
+    available = (await load_availability(session, [flight_id])).get(flight_id, {})
+
+    return {
+        'id': f.id,
+        'name': f.name,
+        'departing_at': f.departing_at,
+        'arriving_at': f.arriving_at,
+        'plane': {
+            'id': f.planes.id,
+            'name': f.planes.name,
+            'total_seat': f.planes.total_seat
+        },
+        'airlines': {
+            'id': f.airlines.id,
+            'name': f.airlines.name,
+            'from_airport': {'id': f.airlines.from_airport.id, 'name': f.airlines.from_airport.name},
+            'to_airport': {'id': f.airlines.to_airport.id, 'name': f.airlines.to_airport.name}
+        },
+        'stops': [{
+            'name': s.name,
+            'airport': {'id': s.airports.id, 'name': s.airports.name},
+            'stop_time_begin': s.stop_time_begin,
+            'stop_time_finish': s.stop_time_finish,
+            'description': s.description
+        } for s in sorted(stops, key=lambda s: s.stop_time_begin)],
+        'available': sum(available.values()),
+        'available_by_rank': available
+    }
+
+
+async def load_availability(session, flight_ids):
+    if not flight_ids:
+        return {}
+    return dao.group_availability((await session.execute(dao.availability_statement(flight_ids))).scalars().all())
+
+
+def relative_path(scope):
+    # tuy may chu ASGI, path co the da gom ca root_path
+    root_path = scope.get('root_path', '')
+    if root_path and scope['path'].startswith(root_path):
+        return scope['path'][len(root_path):]
+    return scope['path']
+
+
+def int_param(params, name):
+    try:
+        return int(params[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+ROUTES = [
+    (re.compile(r'^/search_booking$'), search),
+    (re.compile(r'^/airports$'), airports),
+    (re.compile(r'^/availability$'), availability),
+    (re.compile(r'^/flight/([^/]+)/seats$'), seat_map),
+    (re.compile(r'^/flight/([^/]+)$'), flight_detail)
+]
+
+
+class JsonApi:
+    def __init__(self, url=None, environ=None):
+        environ = os.environ if environ is None else environ
+        self.url = url or async_database_url(environ)
+        self.options = async_engine_options(environ, self.url)
+        self.engine = None
+        self.session_class = None
+
+    def start(self):
+        # tao engine khi may chu khoi dong (lifespan) hoac o yeu cau dau tien
+        if self.engine is None:
+            from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+            self.engine = create_async_engine(self.url, **self.options)
+            self.session_class = AsyncSession
+        return self.engine
+
+    async def stop(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    async def handle(self, path, method, query_string):
+        if method not in ('GET', 'HEAD'):
+            raise ApiError(405, 'Phương thức không được hỗ trợ')
+        params = {k: v[-1] for k, v in parse_qs(query_string).items()}
+        for pattern, handler in ROUTES:
+            match = pattern.match(path)
+            if match:
+                engine = self.start()
+                async with self.session_class(engine, expire_on_commit=False) as session:
+                    return await handler(session, params, *match.groups())
+        raise ApiError(404, 'Không tìm thấy')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await lifespan(receive, send, self.start, self.stop)
+        if scope['type'] != 'http':
+            return
+
+        path = relative_path(scope)
+        try:
+            status, data = 200, await self.handle(path, scope['method'],
+                                                  scope.get('query_string', b'').decode('latin-1'))
+        except ApiError as e:
+            status, data = e.status, {'status': e.status, 'err_msg': e.message}
+        except Exception:
+            app.logger.exception('Lỗi API bất đồng bộ %s', path)
+            status, data = 500, {'status': 500}
+
+        # cung dinh dang JSON voi jsonify cua Flask (ngay gio, Decimal...)
+        body = (app.json.dumps(data) + '\n').encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii'))
+        ]})
+        await send({'type': 'http.response.body', 'body': body if scope['method'] != 'HEAD' else b''})
+
+
+async def lifespan(receive, send, startup, shutdown):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                startup()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+class WsgiBridge:
+    # chay ung dung Flask trong thread pool; moi yeu cau nam tron trong mot thread (ke ca khi tra ve dan)
+    def __init__(self, wsgi_app, workers=32):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wsgi')
+
+    def environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        root_path = scope.get('root_path', '')
+        path = relative_path(scope)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+            'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in scope.get('headers', []):
+            name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+            else:
+                key = 'HTTP_' + name
+                environ[key] = environ[key] + ',' + value if key in environ else value
+        return environ
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+
+        body, more = b'', True
+        while more:
+            message = await receive()
+            body += message.get('body', b'')
+            more = message.get('more_body', False)
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=16)
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def run(environ):
+            started = {}
+
+            def emit(chunk):
+                if 'sent' not in started:
+                    started['sent'] = True
+                    put(('start', started['status'], started['headers']))
+                if chunk:
+                    put(chunk)
+
+            def start_response(status, headers, exc_info=None):
+                started['status'], started['headers'] = int(status.split(' ', 1)[0]), headers
+                return emit
+
+            try:
+                result = self.wsgi_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        emit(chunk)
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+                emit(b'')
+            except Exception as e:
+                put(e)
+            put(None)
+
+        future = loop.run_in_executor(self.executor, run, self.environ(scope, body))
+        started = False
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                if not started:
+                    await send({'type': 'http.response.start', 'status': 500,
+                                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+                    started = True
+                app.logger.error('Lỗi ứng dụng WSGI', exc_info=item)
+                continue
+            if isinstance(item, tuple):
+                started = True
+                await send({'type': 'http.response.start', 'status': item[1],
+                            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in item[2]]})
+            else:
+                await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+        await future
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+class Dispatcher:
+    # API_PREFIX -> JsonApi, con lai -> Flask
+    def __init__(self, api, fallback, prefix=API_PREFIX):
+        self.api = api
+        self.fallback = fallback
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.api(scope, receive, send)
+        path = scope.get('path', '')
+        if path == self.prefix or path.startswith(self.prefix + '/'):
+            scope = dict(scope, root_path=scope.get('root_path', '') + self.prefix)
+            return await self.api(scope, receive, send)
+        return await self.fallback(scope, receive, send)
+
+
+def make_application():
+    from app import index
+
+    return Dispatcher(JsonApi(), WsgiBridge(app.wsgi_app))
+
+
+application = make_application()
@@ -0,0 +1,182 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+import sqlalchemy
+from app import app, db, dao, synthetic
+from app.cache import response_cache
+from app.jobs import count_queries
+from app.models import Flight
+
+
+# do thoi gian cac ham dao va trang chinh tren du lieu gia lap o nhieu kich thuoc, ghi ket qua ra JSON
+# vd: DB_ENGINE=sqlite DB_SQLITE_PATH=/tmp/bench.db python -m app.benchmark --sizes 100,1000,10000 --out bench.json
+def dao_cases(start):
+    month = start.strftime('%Y-%m')
+    window = (start + timedelta(days=1), start + timedelta(days=1, hours=3))
+    return [
+        ('load_flights', lambda: dao.load_flights(channel='customer')),
+        ('search_flights', lambda: dao.search_flights(from_airport_id=1, channel='customer')),
+        ('check_plane_in_flight', lambda: dao.check_plane_in_flight(window[0], window[1], 'MB1')),
+        ('statistic_revenue', lambda: dao.statistic_revenue()),
+        ('statistic_revenue_follow_month', lambda: dao.statistic_revenue_follow_month('Tuyến 1', month)),
+        ('get_seat_map', lambda: dao.get_seat_map('S1'))
+    ]
+
+
+def endpoint_cases(start):
+    month = start.strftime('%Y-%m')
+    return [
+        ('GET /', None, '/'),
+        ('GET /booking', None, '/booking'),
+        ('GET /search_booking', None, '/search_booking'),
+        ('GET /api/search_booking', None, '/api/search_booking'),
+        ('GET /flight/<id>', None, '/flight/S1'),
+        ('GET /api/flight/<id>/seats', None, '/api/flight/S1/seats'),
+        ('GET /admin/flights/', 'admin', '/admin/flights/'),
+        ('GET /admin/flights/edit/', 'admin', '/admin/flights/edit/?id=S1'),
+        ('GET /admin/statsview/', 'admin', '/admin/statsview/?airline_name=Tuyến 1&month=' + month)
+    ]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def measure(run, repeat, warmup=1):
+    # bo dem trang duoc xoa truoc moi lan chay de do truy van CSDL, khong do bo dem
+    for i in range(warmup):
+        response_cache.invalidate('flights', 'airports')
+        run()
+    timings, statements, status = [], 0, None
+    for i in range(repeat):
+        response_cache.invalidate('flights', 'airports')
+        with count_queries() as executed:
+            start = time.perf_counter()
+            result = run()
+            timings.append((time.perf_counter() - start) * 1000)
+        statements = len(executed)
+        status = getattr(result, 'status_code', status)
+    return {
+        'runs': repeat,
+        'min_ms': min(timings),
+        'median_ms': percentile(timings, 50),
+        'mean_ms': sum(timings) / len(timings),
+        'p95_ms': percentile(timings, 95),
+        'max_ms': max(timings),
+        'statements': statements,
+        'status': status
+    }
+
+
+def run_size(flights, tickets_per_flight, repeat, seed):
+    start = time.perf_counter()
+    dataset = synthetic.generate(flights=flights, tickets=flights * tickets_per_flight, seed=seed)
+    dataset['generate_s'] = time.perf_counter() - start
+    first = db.session.query(db.func.min(Flight.departing_at)).scalar()
+    db.session.remove()
+
+    results = []
+    for name, run in dao_cases(first):
+        results.append(dict(measure(lambda: (run(), db.session.remove()), repeat), case=name, kind='dao'))
+
+    clients = {None: app.test_client(), 'admin': app.test_client()}
+    clients['admin'].post('/login/', data={'username': 'admin', 'password': synthetic.PASSWORD})
+    for name, who, url in endpoint_cases(first):
+        client = clients[who]
+        results.append(dict(measure(lambda: client.get(url), repeat), case=name, kind='endpoint'))
+
+    for r in results:
+        r['size'] = flights
+    return dataset, results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=app.root_path).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    # so median voi lan chay truoc; cham hon threshold lan thi tinh la cham di
+    previous = {(r['size'], r['case']): r for r in baseline.get('results', [])}
+    regressions = []
+    for r in results:
+        old = previous.get((r['size'], r['case']))
+        if not old or not old['median_ms']:
+            continue
+        ratio = r['median_ms'] / old['median_ms']
+        r['baseline_median_ms'] = old['median_ms']
+        r['ratio'] = ratio
+        if ratio > threshold:
+            regressions.append(r)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.benchmark')
+    parser.add_argument('--sizes', default='100,1000,10000', help='số chuyến bay, cách nhau bởi dấu phẩy')
+    parser.add_argument('--tickets-per-flight', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--baseline', help='tệp JSON của lần chạy trước để so sánh')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    parser.add_argument('--allow-reset', action='store_true',
+                        help='cho phép xóa CSDL không phải sqlite (mỗi kích thước đều tạo lại CSDL)')
+    args = parser.parse_args(argv)
+
+    from app import index
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        if dialect != 'sqlite' and not args.allow_reset:
+            print('Benchmark xóa và tạo lại CSDL %s; chạy với DB_ENGINE=sqlite hoặc thêm --allow-reset' % dialect)
+            return 1
+
+        report = {
+            'meta': {
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'sqlalchemy': sqlalchemy.__version__,
+                'dialect': dialect,
+                'repeat': args.repeat,
+                'seed': args.seed,
+                'tickets_per_flight': args.tickets_per_flight
+            },
+            'datasets': [],
+            'results': []
+        }
+        for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+            dataset, results = run_size(size, args.tickets_per_flight, args.repeat, args.seed)
+            report['datasets'].append(dataset)
+            report['results'].extend(results)
+            print('== %s chuyến bay, %s vé (tạo trong %.1fs)' % (size, dataset['tickets'], dataset['generate_s']))
+            for r in results:
+                print('  %-36s %9.2f ms  p95 %9.2f ms  %3s câu SQL  %s'
+                      % (r['case'], r['median_ms'], r['p95_ms'], r['statements'], r['status'] or ''))
+
+    failed = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report['results'], json.load(f), args.threshold)
+        for r in regressions:
+            print('CHẬM HƠN %s (%s chuyến bay): %.2f ms -> %.2f ms (x%.2f)'
+                  % (r['case'], r['size'], r['baseline_median_ms'], r['median_ms'], r['ratio']))
+        failed = 1 if regressions else 0
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print('Đã ghi kết quả vào %s' % args.out)
+    return failed
+
+
+if __name__ == '__main__':
+    sys.exit(main())
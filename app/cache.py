@@ -0,0 +1,191 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response
+from flask_login import current_user
+from sqlalchemy import event
+from app import app
+from app.models import Flight, Flight_AirportMedium, AirPort, AirLine
+
+
+class LRUBackend:
+    # bo nho dem trong tien trinh, day muc cu nhat ra khi day
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires and expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + timeout if timeout else None)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def get_version(self, tag):
+        return self._versions.get(tag, 0)
+
+    def bump(self, tag):
+        with self._lock:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+
+
+class LocalClient:
+    # thay the redis khi chay thu: get/set(ex)/delete/incr tren dict
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (None, None))
+            if expires and expires < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._data.get(key, (0, None))[0]) + 1
+            self._data[key] = (str(value).encode('utf-8'), None)
+            return value
+
+
+class SharedBackend:
+    # dung chung giua cac worker qua client kieu redis
+    def __init__(self, client, prefix='qlcb:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, timeout=None):
+        self.client.set(self.prefix + key, json.dumps(value).encode('utf-8'), ex=timeout)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def get_version(self, tag):
+        return int(self.client.get(self.prefix + 'tag:' + tag) or 0)
+
+    def bump(self, tag):
+        self.client.incr(self.prefix + 'tag:' + tag)
+
+
+def make_backend(config):
+    if config.get('CACHE_BACKEND') == 'shared':
+        if config.get('CACHE_REDIS_URL'):
+            import redis
+            return SharedBackend(redis.Redis.from_url(config['CACHE_REDIS_URL']))
+        return SharedBackend(LocalClient())
+    return LRUBackend(config.get('CACHE_LRU_SIZE', 512))
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def versions(self, tags):
+        return [self.backend.get_version(t) for t in tags]
+
+    def invalidate(self, *tags):
+        for t in tags:
+            self.backend.bump(t)
+
+    def cached(self, tags, timeout=300, public=False, vary=None):
+        # public=False: trang co hien thong tin dang nhap, chi dem cho khach chua dang nhap
+        # vary: ham tra ve chuoi them vao khoa, vd ket qua khac nhau theo vai tro
+        def decorator(f):
+            @wraps(f)
+            def decorated_func(*args, **kwargs):
+                if request.method != 'GET' or (not public and current_user.is_authenticated):
+                    return f(*args, **kwargs)
+
+                key = 'view:' + request.full_path
+                if vary:
+                    key += ':' + vary()
+                versions = self.versions(tags)
+                entry = self.backend.get(key)
+
+                if entry and entry['versions'] == versions:
+                    self.hits += 1
+                    response = app.response_class(base64.b64decode(entry['body']), mimetype=entry['mimetype'])
+                else:
+                    self.misses += 1
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    body = response.get_data()
+                    entry = {
+                        'versions': versions,
+                        'etag': hashlib.md5(body).hexdigest(),
+                        'body': base64.b64encode(body).decode('ascii'),
+                        'mimetype': response.mimetype
+                    }
+                    self.backend.set(key, entry, timeout)
+
+                response.set_etag(entry['etag'])
+                if entry['etag'] in request.if_none_match:
+                    response = app.response_class(status=304)
+                    response.set_etag(entry['etag'])
+                return response
+
+            return decorated_func
+
+        return decorator
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+response_cache = ResponseCache(make_backend(app.config))
+
+
+def invalidate_on_write(model, *tags):
+    def changed(mapper, connection, target):
+        response_cache.invalidate(*tags)
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, name, changed)
+
+
+invalidate_on_write(Flight, 'flights')
+invalidate_on_write(Flight_AirportMedium, 'flights')
+invalidate_on_write(AirPort, 'airports', 'flights')
+invalidate_on_write(AirLine, 'airlines', 'flights')
@@ -1,5 +1,11 @@
+import time as clock
 from flask import render_template, request, redirect, session, jsonify, url_for
-from app import app, dao, dao, db
+from app import app, dao, dao, db, passwords
+from app.route_graph import route_graph
+from app.cache import response_cache
+from app.database import pool_metrics
+from app.metrics import request_metrics, render_prometheus
+from app.exports import export_progress
 from flask_login import login_user, logout_user, login_required
 from app.decorators import anonymous_user
 from app.models import *
@@ -7,8 +13,9 @@ from flask_login import current_user
 
 
 # hiển thị flight
+@response_cache.cached(tags=('flights',))
 def index():
-    flight = dao.load_flights()
+    flight = dao.load_flights(profile='listing', channel=dao.sale_channel(current_user))
     return render_template('index.html', flights=flight)
 
 
@@ -43,6 +50,7 @@ def register():
 
 
 # đặt vé
+@response_cache.cached(tags=('flights', 'airports'))
 def booking():
     session['ticket'] = {
         "1": {
@@ -69,7 +77,7 @@ def booking():
     }
     airports = dao.load_airports()
     flights = []
-    for f in dao.load_flights():
+    for f in dao.load_flights(profile='listing', channel=dao.sale_channel(current_user)):
         flights.append(f)
     flights_num = len(flights)
 
@@ -82,8 +90,13 @@ def login_my_user():
         username = request.form['username']
         password = request.form['password']
 
+        if not passwords.allow_login(username, request.remote_addr):
+            err_msg = "Đăng nhập sai quá nhiều lần. Vui lòng thử lại sau!"
+            return render_template("login.html", err_msg=err_msg), 429
+
         user = dao.check_login(username=username, password=password)
         if user:
+            passwords.login_succeeded(username)
             login_user(user=user)
             if user.user_role == UserRole.ADMIN:
                 return redirect('/admin')
@@ -100,13 +113,15 @@ def login_my_user():
 
 
 
+@response_cache.cached(tags=('flights', 'airports'), timeout=30)
 def search_booking():
     airports = dao.load_airports()
-    flights = []
-    for f in dao.load_flights():
-        flights.append(f)
+    flights, next_cursor = dao.search_flights(page_size=app.config['FLIGHT_PAGE_SIZE'],
+                                              channel=dao.sale_channel(current_user))
     flights_num = len(flights)
-    return render_template('search_booking.html', airports=airports, flights=flights, flights_num=flights_num)
+    availability = dao.get_availability([f.id for f in flights])
+    return render_template('search_booking.html', airports=airports, flights=flights, flights_num=flights_num,
+                           next_cursor=next_cursor, availability=availability)
 
     # airports = dao.load_airports()
     # airlines = dao.load_airlines()
@@ -172,9 +187,14 @@ def from_airport(from_airport_id):
 
 
 def details(flight_id):
-    f = dao.get_flight_by_id(flight_id)
+    f = dao.get_flight_by_id(flight_id, profile='detail')
     m = dao.get_apm_by_flight_id(flight_id)
-    return render_template('detail.html', flight=f, Flight_AirportMedium=m)
+    availability = dao.get_availability([flight_id]).get(flight_id, {})
+    return render_template('detail.html', flight=f, Flight_AirportMedium=m, availability=availability)
+
+
+def seat_map(flight_id):
+    return jsonify(dao.get_seat_map(flight_id))
 
 
 # def confirm(flight_id):
@@ -273,22 +293,86 @@ def details(flight_id):
 #     return jsonify(utils.cart_stats(cart))
 
 
+def parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+@response_cache.cached(tags=('flights',), timeout=30, public=True, vary=lambda: dao.sale_channel(current_user))
 def load_flights():
+    page_size = request.args.get('page_size', app.config['FLIGHT_PAGE_SIZE'], type=int)
+    page_size = max(1, min(page_size, app.config['FLIGHT_PAGE_SIZE_MAX']))
+
+    flights, next_cursor = dao.search_flights(from_airport_id=request.args.get('from_airport_id', type=int),
+                                              to_airport_id=request.args.get('to_airport_id', type=int),
+                                              date_from=parse_date(request.args.get('date_from')),
+                                              date_to=parse_date(request.args.get('date_to')),
+                                              kw=request.args.get('kw'),
+                                              cursor=request.args.get('cursor'),
+                                              page_size=page_size,
+                                              channel=dao.sale_channel(current_user))
+    availability = dao.get_availability([a.id for a in flights])
     data = []
 
-    for a in dao.load_flights():
+    for a in flights:
         data.append({
+            'id': a.id,
+            'name': a.name,
             'departing_at': a.departing_at,
             'arriving_at': a.arriving_at,
             'plane_id': a.plane_id,
             'airlines': {
                 'name': a.airlines.name
-            }
+            },
+            'available': sum(availability.get(a.id, {}).values()),
+            'available_by_rank': availability.get(a.id, {})
         })
 
-    return jsonify(data)
+    return jsonify({
+        'flights': data,
+        'next_cursor': next_cursor
+    })
+
+
+def itineraries():
+    date = parse_date(request.args.get('date'))
+    from_airport_id = request.args.get('from_airport_id', type=int)
+    to_airport_id = request.args.get('to_airport_id', type=int)
+    if not (date and from_airport_id and to_airport_id):
+        return jsonify({'status': 400, 'err_msg': 'Vui lòng chọn nơi đi, nơi đến và ngày bay'})
+
+    max_connections = min(request.args.get('max_connections', 1, type=int), 3)
+    min_connection = timedelta(minutes=request.args.get('min_connection', 45, type=int))
+    data = []
+
+    paths = route_graph.search(from_airport_id, to_airport_id, date.date(),
+                               max_connections=max_connections,
+                               min_connection=min_connection)
+    # bo hanh trinh co chuyen bay da het han dat/ban ve
+    on_sale = dao.open_flight_ids({leg.flight_id for path in paths for leg in path},
+                                  dao.sale_channel(current_user))
+    for path in paths:
+        if any(leg.flight_id not in on_sale for leg in path):
+            continue
+        data.append({
+            'departing_at': path[0].departing_at,
+            'arriving_at': path[-1].arriving_at,
+            'connections': len(path) - 1,
+            'legs': [{
+                'flight_id': leg.flight_id,
+                'from_airport_id': leg.from_airport_id,
+                'to_airport_id': leg.to_airport_id,
+                'departing_at': leg.departing_at,
+                'arriving_at': leg.arriving_at
+            } for leg in path]
+        })
 
+    return jsonify({'status': 200, 'itineraries': data})
 
+
+@response_cache.cached(tags=('airports',), public=True)
 def airports():
     data = []
 
@@ -301,17 +385,83 @@ def airports():
     return jsonify(data)
 
 
+# tình trạng kết nối CSDL cho quản trị viên: thời gian chờ pool, độ đầy, thời gian ping
+def db_health():
+    if not current_user.is_authenticated or current_user.user_role != UserRole.ADMIN:
+        return jsonify({'status': 403}), 403
+
+    start = clock.perf_counter()
+    try:
+        db.session.execute(db.select(1))
+        ping, status = clock.perf_counter() - start, 200
+    except Exception:
+        ping, status = None, 500
+
+    return jsonify({
+        'status': status,
+        'ping': ping,
+        'pools': pool_metrics.stats(db.engines),
+        'slow_queries': request_metrics.slow_queries()
+    }), status
+
+
+# số liệu theo endpoint (độ trễ, số câu SQL...) và các bộ đệm, định dạng Prometheus, chỉ cho quản trị viên
+def prometheus_metrics():
+    if not current_user.is_authenticated or current_user.user_role != UserRole.ADMIN:
+        return 'forbidden\n', 403, {'Content-Type': 'text/plain; charset=utf-8'}
+
+    pools = pool_metrics.stats(db.engines)
+    caches = {
+        'response': response_cache.stats(),
+        'user': dao.user_cache.stats(),
+        'regulation': dao.regulation_cache.stats()
+    }
+    extra = [
+        ('qlcb_db_pool_checked_out', 'gauge', 'Số kết nối đang dùng',
+         [([('pool', n)], s.get('checked_out', 0)) for n, s in pools.items()]),
+        ('qlcb_db_pool_saturation', 'gauge', 'Tỉ lệ kết nối đang dùng trên sức chứa pool',
+         [([('pool', n)], s.get('saturation', 0)) for n, s in pools.items()]),
+        ('qlcb_db_pool_wait_seconds_total', 'counter', 'Tổng thời gian chờ lấy kết nối',
+         [([('pool', n)], s['wait_total']) for n, s in pools.items()]),
+        ('qlcb_db_pool_timeouts_total', 'counter', 'Số lần chờ kết nối quá hạn',
+         [([('pool', n)], s['timeouts']) for n, s in pools.items()]),
+        ('qlcb_cache_hits_total', 'counter', 'Số lần trúng bộ đệm',
+         [([('cache', n)], s['hits']) for n, s in caches.items()]),
+        ('qlcb_cache_misses_total', 'counter', 'Số lần trượt bộ đệm',
+         [([('cache', n)], s['misses']) for n, s in caches.items()]),
+        ('qlcb_login_throttled_total', 'counter', 'Số lần đăng nhập bị chặn do thử quá nhiều',
+         [([('key', 'user')], passwords.user_throttle.rejected),
+          ([('key', 'ip')], passwords.ip_throttle.rejected)])
+    ]
+    return render_prometheus(extra), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def export_status(export_id):
+    # tien do file dang xuat (id lay tu header X-Export-Id), chi co trong tien trinh dang gui file
+    if not current_user.is_authenticated or current_user.user_role not in (UserRole.ADMIN, UserRole.EMPLOYEE):
+        return jsonify({'status': 403}), 403
+
+    progress = export_progress.get(export_id)
+    if progress is None:
+        return jsonify({'status': 404, 'err_msg': 'Không tìm thấy lượt xuất dữ liệu'}), 404
+    return jsonify(dict(progress, status=200, state=progress['status']))
+
+
 @login_required
 def pay():
     key = app.config['CART_KEY']
     cart = session.get(key)
 
     try:
-        dao.save_receipt(cart)
+        msg, booking_code, tickets = dao.save_receipt(cart)
     except:
         return jsonify({'status': 500})
-    else:
-        return jsonify({'status': 200})
+
+    if msg != 'success':
+        return jsonify({'status': 400, 'err_msg': msg})
+
+    del session[key]
+    return jsonify({'status': 200, 'booking_code': booking_code, 'tickets': tickets})
 
 
 def pay1():
@@ -329,5 +479,12 @@ def get_booking():
         birthday = request.form['birthday']
         sdt = request.form['sdt']
         email = request.form['email']
-        dao.check_profile(name=name,dob=birthday,email=email,phone=sdt)
+        key = app.config['CART_KEY']
+        cart = dao.add_to_cart(session.get(key, {}), flight_id=request.form.get('from'),
+                               rank=request.form.get('rank', 2), name=name, dob=birthday,
+                               email=email, phone=sdt, cccd=request.form.get('cccd', ''),
+                               gender=request.form.get('gender', 'nam'), hold=True,
+                               channel=dao.sale_channel(current_user))
+        if cart:
+            session[key] = cart
     return redirect('/')
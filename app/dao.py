@@ -1,33 +1,130 @@
 import random
 
-from app.models import User, Profile, AirPlane, Seat, AirPort, AirLine, Flight, Flight_AirportMedium, \
-    PlaneTicket, Regulation,FA_Regulation
-from app import db
-from flask_login import current_user
-from sqlalchemy import func
-import hashlib
-from datetime import datetime
-from sqlalchemy.sql import extract
+from app.models import UserRole, User, Profile, AirPlane, Seat, AirPort, AirLine, Flight, Flight_AirportMedium, \
+    PlaneTicket, Regulation,FA_Regulation, FlightAvailability, ticket_regulation, RevenueRollup, SeatLayout, SeatHold
+from app import app, db
+from app.passwords import password_hasher
+from app.database import read_replica
+from app import seatmap
+from flask_login import current_user, UserMixin
+from sqlalchemy import func, or_, and_, case, event, bindparam
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+from sqlalchemy.exc import OperationalError, IntegrityError
+from sqlalchemy.dialects import mysql, sqlite, postgresql
+import base64
+import uuid
+import threading
+from collections import namedtuple, OrderedDict
+import time
+from decimal import Decimal, InvalidOperation
+from datetime import datetime, timedelta
+
+
+
+
+class UserSnapshot(namedtuple('UserSnapshot', ['id', 'name', 'username', 'user_role', 'active']), UserMixin):
+    # ban sao chi doc cua User cho flask-login, khong gan voi session
+    @property
+    def is_active(self):
+        return self.active is not False
+
+    def __str__(self):
+        return str(self.id)
+
+
+class UserCache:
+    # LRU co thoi han cho user_loader, xoa khi User bi sua/xoa
+    def __init__(self, ttl=60, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            item = self._items.get(user_id)
+            if item and time.monotonic() - item[1] <= self.ttl:
+                self._items.move_to_end(user_id)
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+
+        row = db.session.query(User.id, User.name, User.username, User.user_role, User.active) \
+            .filter(User.id.__eq__(user_id)).first()
+        if row is None:
+            return None
+
+        snapshot = UserSnapshot(*row)
+        with self._lock:
+            self._items[user_id] = (snapshot, time.monotonic())
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            self.invalidations += 1
+            if user_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(user_id, None)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'size': len(self._items)
+        }
+
+
+user_cache = UserCache(app.config.get('USER_CACHE_TTL', 60), app.config.get('USER_CACHE_SIZE', 10000))
 
 
+def user_changed(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
+
+for name in ('after_update', 'after_delete'):
+    event.listen(User, name, user_changed)
 
 
 def get_user_by_id(user_id):
-    return User.query.get(user_id)
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    user = user_cache.get(user_id)
+    # tai khoan bi khoa thi phien dang nhap cu cung het hieu luc
+    if user is None or not user.is_active:
+        return None
+    return user
 
 
 def check_login(username, password):
     if username and password:
-        password = str(hashlib.md5(password.strip().encode('utf-8')).hexdigest())
+        user = User.query.filter(User.username.__eq__(username.strip())).first()
+        if user is None:
+            password_hasher.dummy_verify(password)
+            return None
 
-        return User.query.filter(User.username.__eq__(username.strip()),
-                                 User.password.__eq__(password)).first()
+        ok, new_password = password_hasher.verify(password, user.password)
+        if not ok:
+            return None
+        if new_password:
+            # tai khoan cu (md5) duoc bam lai ngay khi dang nhap dung
+            user.password = new_password
+            db.session.commit()
+        return user
 
 
 def register(name, username, password):
     if name and username and password:
-        password = str(hashlib.md5(password.strip().encode('utf-8')).hexdigest())
-        u = User(name=name, username=username.strip(), password=password)
+        u = User(name=name, username=username.strip(), password=password_hasher.hash(password))
         db.session.add(u)
         db.session.commit()
 
@@ -38,14 +135,47 @@ def check_profile(name,dob,email,phone):
         db.session.commit()
 
 
+@read_replica
 def load_airports():
     return AirPort.query.all()
 
 
+# cach nap quan he cho tung loai trang, tranh 1 + N truy van khi template duyet quan he
+QUERY_PROFILES = {
+    'listing': [
+        joinedload(Flight.airlines).joinedload(AirLine.from_airport)
+    ],
+    'detail': [
+        joinedload(Flight.airlines).joinedload(AirLine.from_airport),
+        joinedload(Flight.planes)
+    ],
+    'admin-edit': [
+        joinedload(Flight.airlines),
+        selectinload(Flight.regulations)
+    ],
+    # API bat dong bo khong nap lazy duoc, phai nap du moi quan he se doc
+    'api-detail': [
+        joinedload(Flight.airlines).joinedload(AirLine.from_airport),
+        joinedload(Flight.airlines).joinedload(AirLine.to_airport),
+        joinedload(Flight.planes)
+    ]
+}
+
+
+def flight_query(profile=None):
+    query = Flight.query
+    if profile:
+        query = query.options(*QUERY_PROFILES[profile])
+    return query
+
+
+def stops_statement(flight_id):
+    return db.select(Flight_AirportMedium).options(joinedload(Flight_AirportMedium.airports)) \
+        .where(Flight_AirportMedium.flight_id.__eq__(flight_id))
+
+
 def get_apm_by_flight_id(flight_id):
-    return Flight_AirportMedium.query.filter(
-        Flight_AirportMedium.flight_id.__eq__(flight_id)
-    ).all()
+    return db.session.execute(stops_statement(flight_id)).scalars().all()
 
 
 def del_apm(flight_id, airport_id):
@@ -70,14 +200,158 @@ def take_time(str_date, format):
     return time
 
 
+def parse_regulation_value(value):
+    try:
+        return take_time(value, "%H:%M:%S")
+    except ValueError:
+        pass
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return value
+
+
+class RegulationCache:
+    # toan bo bang quy dinh duoc nap mot lan, xoa khi RegulationView luu thay doi
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._by_id = None
+        self._by_name = None
+        self._ids = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        by_id, by_name, ids = {}, {}, {}
+        for id, name, value in db.session.query(Regulation.id, Regulation.name, Regulation.value).all():
+            by_id[id] = by_name[name] = parse_regulation_value(value)
+            ids[name] = id
+        self._by_id, self._by_name, self._ids = by_id, by_name, ids
+        self._loaded_at = time.monotonic()
+
+    def _values(self, key):
+        with self._lock:
+            # bang quy dinh rong (chua khoi tao du lieu) thi khong giu lai ket qua
+            if not self._by_id or time.monotonic() - self._loaded_at > self.ttl:
+                self.misses += 1
+                self._load()
+            else:
+                self.hits += 1
+            return getattr(self, key)
+
+    def get(self, id):
+        return self._values('_by_id').get(int(id))
+
+    def get_by_name(self, name):
+        return self._values('_by_name').get(name)
+
+    def get_id(self, name):
+        return self._values('_ids').get(name)
+
+    def invalidate(self):
+        with self._lock:
+            self._by_id = self._by_name = self._ids = None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+regulation_cache = RegulationCache()
+
+
 def get_regulation_time_by_id(id):
-    date = Regulation.query.get(id)
-    if date:
-        return take_time(date.get_value(), "%H:%M:%S")
+    value = regulation_cache.get(id)
+    if isinstance(value, timedelta):
+        return value
     else:
         return None
 
 
+# kenh ban ve -> cot han chot: khach dat online theo book_time, nhan vien ban tai quay theo sale_time
+SALE_CHANNELS = {
+    'customer': ('booking_closes_at', 'book_time'),
+    'staff': ('sale_closes_at', 'sale_time')
+}
+
+
+def sale_channel(user=None):
+    if user is not None and user.is_authenticated and user.user_role in (UserRole.EMPLOYEE, UserRole.ADMIN):
+        return 'staff'
+    return 'customer'
+
+
+def sale_closes_column(channel):
+    return getattr(Flight, SALE_CHANNELS[channel][0])
+
+
+def sale_offsets(conn=None):
+    # {cot han chot: khoang thoi gian truoc gio khoi hanh}; chua co quy dinh thi ban den luc cat canh
+    if conn is None:
+        values = {r: regulation_cache.get_by_name(r) for c, r in SALE_CHANNELS.values()}
+    else:
+        values = {name: parse_regulation_value(value) for name, value in conn.execute(
+            db.select(Regulation.name, Regulation.value)
+            .where(Regulation.name.in_([r for c, r in SALE_CHANNELS.values()])))}
+    return {c: values.get(r) if isinstance(values.get(r), timedelta) else timedelta(0)
+            for c, r in SALE_CHANNELS.values()}
+
+
+def sale_windows(departing_at, offsets=None):
+    offsets = offsets or sale_offsets()
+    return {c: departing_at - offset for c, offset in offsets.items()}
+
+
+def set_sale_windows(mapper, connection, target):
+    if target.departing_at is not None:
+        for column, value in sale_windows(target.departing_at).items():
+            setattr(target, column, value)
+
+
+for name in ('before_insert', 'before_update'):
+    event.listen(Flight, name, set_sale_windows)
+
+
+def refresh_sale_windows(conn=None, since=None, batch_size=1000):
+    # tinh lai han chot khi doi book_time/sale_time; mac dinh chi cac chuyen bay chua khoi hanh
+    conn = conn or db.session
+    offsets = sale_offsets(None if conn is db.session else conn)
+    query = db.select(Flight.id, Flight.departing_at)
+    if since is not False:
+        query = query.where(Flight.departing_at >= (since or datetime.now()))
+
+    update = Flight.__table__.update().where(Flight.id.__eq__(bindparam('flight_id'))) \
+        .values(booking_closes_at=bindparam('b_booking'), sale_closes_at=bindparam('b_sale'))
+    rows = conn.execute(query).all()
+    for i in range(0, len(rows), batch_size):
+        batch = []
+        for flight_id, departing_at in rows[i:i + batch_size]:
+            windows = sale_windows(departing_at, offsets)
+            batch.append({'flight_id': flight_id, 'b_booking': windows['booking_closes_at'],
+                          'b_sale': windows['sale_closes_at']})
+        conn.execute(update, batch)
+    return len(rows)
+
+
+def open_flight_ids(flight_ids, channel='customer', now=None):
+    now = now or datetime.now()
+    return {f for f, in db.session.query(Flight.id).filter(Flight.id.in_(flight_ids),
+                                                           sale_closes_column(channel) > now)}
+
+
+def check_sale_window(flight_ids, channel='customer', now=None):
+    # tra ve 'success' hoac thong bao chuyen bay da het han dat/ban ve
+    closed = set(flight_ids) - open_flight_ids(flight_ids, channel, now)
+    if closed:
+        return 'Chuyến bay %s đã hết thời gian %s' % (', '.join(sorted(closed)),
+                                                     'bán vé' if channel == 'staff' else 'đặt vé')
+    return 'success'
+
+
 def check_time_flight(departing_at, arriving_at, regulation_id):
     duration = arriving_at - departing_at
     rt = get_regulation_time_by_id(regulation_id)
@@ -92,20 +366,64 @@ def check_time_flight(departing_at, arriving_at, regulation_id):
     return msg
 
 
-def check_plane_in_flight(departing_at, arriving_at, plane):
-    planes = Flight.query.filter(Flight.plane_id.__eq__(plane)).all()
-    if planes:
-        for p in planes:
-            if arriving_at < p.departing_at or p.arriving_at < departing_at:
-                msg = "success"
-            else:
-                msg = "Máy bay đã có lịch bay trong khoảng thời gian này"
+def find_plane_conflicts(departing_at, arriving_at, plane, exclude_flight_id=None):
+    query = Flight.query.filter(Flight.plane_id.__eq__(plane),
+                                Flight.departing_at <= arriving_at,
+                                Flight.arriving_at >= departing_at)
+    if exclude_flight_id:
+        query = query.filter(Flight.id != exclude_flight_id)
+
+    return query.order_by(Flight.departing_at).all()
+
+
+def check_plane_in_flight(departing_at, arriving_at, plane, exclude_flight_id=None):
+    if find_plane_conflicts(departing_at, arriving_at, plane, exclude_flight_id):
+        msg = "Máy bay đã có lịch bay trong khoảng thời gian này"
     else:
         msg = "success"
 
     return msg
 
 
+def check_schedule_conflicts(schedule):
+    # schedule: danh sach dict {'id', 'plane', 'departing_at', 'arriving_at'}
+    # tra ve {id chuyen bay moi: [id cac chuyen bay bi trung lich]}
+    conflicts = {}
+    if not schedule:
+        return conflicts
+
+    proposed_ids = set()
+    by_plane = {}
+    for f in schedule:
+        proposed_ids.add(f['id'])
+        conflicts[f['id']] = []
+        by_plane.setdefault(f['plane'], []).append((f['departing_at'], f['arriving_at'], f['id']))
+
+    begin = min(f['departing_at'] for f in schedule)
+    end = max(f['arriving_at'] for f in schedule)
+    existing = db.session.query(Flight.plane_id, Flight.departing_at, Flight.arriving_at, Flight.id) \
+        .filter(Flight.plane_id.in_(by_plane.keys()),
+                Flight.departing_at <= end,
+                Flight.arriving_at >= begin).all()
+    for plane_id, departing_at, arriving_at, flight_id in existing:
+        if flight_id not in proposed_ids:
+            by_plane[plane_id].append((departing_at, arriving_at, flight_id))
+
+    for intervals in by_plane.values():
+        intervals.sort()
+        active = []
+        for departing_at, arriving_at, flight_id in intervals:
+            active = [a for a in active if a[0] >= departing_at]
+            for other_arriving_at, other_id in active:
+                if flight_id in proposed_ids:
+                    conflicts[flight_id].append(other_id)
+                if other_id in proposed_ids:
+                    conflicts[other_id].append(flight_id)
+            active.append((arriving_at, flight_id))
+
+    return conflicts
+
+
 def check_flight(id, name, departing_at, arriving_at, plane, regulation_id):
     if id and name and departing_at and arriving_at:
         flight = Flight.query.filter(Flight.id.__eq__(id.strip())).first()
@@ -127,6 +445,8 @@ def save_flight(id, name, departing_at, arriving_at, plane, airline, fl_reg):
                plane_id=plane, airline_id=al_id.id)
     f.regulations.append(fl_reg)
     db.session.add(f)
+    db.session.flush()
+    build_seat_maps(db.session, [id])
     db.session.commit()
 
 
@@ -149,7 +469,8 @@ def check_time_stop(begin, finish, flight_id, list_regulation):
     if rt_begin and rt_finish:
         if stop_duration.total_seconds() >= rt_begin.total_seconds() \
                 and stop_duration.total_seconds() <= rt_finish.total_seconds():
-            f = Flight.query.get(flight_id)
+            f = db.session.query(Flight.departing_at, Flight.arriving_at) \
+                .filter(Flight.id.__eq__(flight_id)).first()
             if begin > f.departing_at and finish < f.arriving_at:
                 check_duration_msg = 'success'
             else:
@@ -213,13 +534,127 @@ def update_apm(model, name, stop_time_begin, stop_time_finish, description, flig
 
 
 
+def check_stop_window(begin, finish, departing_at, arriving_at, airport, airline, used, list_regulation):
+    # kiem tra tram dung hoan toan trong bo nho, dung quy dinh da dem
+    rt_begin = get_regulation_time_by_id(list_regulation[0])
+    rt_finish = get_regulation_time_by_id(list_regulation[1])
+    if not (rt_begin and rt_finish):
+        return 'Vui lòng thiết lập quy định về thời gian dừng tối thiểu và tối đa'
+    if not rt_begin <= finish - begin <= rt_finish:
+        return 'Thời gian dừng không đúng quy định'
+    if not (begin > departing_at and finish < arriving_at):
+        return 'Thời gian dừng không phù hợp với thời gian bay'
+    if airport is None:
+        return 'Thông tin trạm dừng chưa được điền đầy đủ'
+    if airport.id == airline.from_airport_id or airport.id == airline.to_airport_id:
+        return 'Sân bay dừng đã thuộc tuyến bay'
+    if airport.id in used:
+        return 'Sân bay này đã được chọn làm trung gian. Vui lòng chọn sân bay khác!'
+    return 'success'
+
+
+def edit_flight(model, flight, edits, new_stops, airlines, airports, fl_reg, stop_reg):
+    # flight: id, name, departing_at, arriving_at, plane, airline (ten tuyen)
+    # edits: [(tram dung hien co, du lieu moi)], new_stops: [du lieu tram moi]
+    # airlines/airports: {ten: doi tuong} da nap san cho form
+    # tra ve (sts_msg, am_edit_msg, am_msg); chi commit mot lan khi tat ca hop le
+    am_edit_msg = am_msg = ''
+    airline = airlines.get(flight['airline'])
+    times_changed = flight['departing_at'] != model.departing_at or flight['arriving_at'] != model.arriving_at
+    route_changed = airline is None or airline.id != model.airline_id
+
+    sts_msg = 'success' if airline else 'Tuyến bay không tồn tại'
+    if sts_msg == 'success' and times_changed:
+        sts_msg = check_time_flight(flight['departing_at'], flight['arriving_at'], fl_reg[0])
+    if sts_msg == 'success' and (times_changed or flight['plane'] != model.plane_id):
+        sts_msg = check_plane_in_flight(flight['departing_at'], flight['arriving_at'], flight['plane'],
+                                        exclude_flight_id=model.id)
+    if sts_msg == 'success' and flight['id'] != model.id \
+            and db.session.query(Flight.id).filter(Flight.id.__eq__(flight['id'].strip())).first():
+        sts_msg = "Mã chuyến bay đã tồn tại! Vui lòng đổi sang nội dung khác!"
+    if sts_msg != 'success':
+        return sts_msg, am_edit_msg, am_msg
+
+    used = set()
+    for apm, data in edits:
+        am_edit_msg = 'success'
+        airport = airports.get(data['airport'])
+        if times_changed or route_changed or airport is None or airport.id != apm.airport_medium_id \
+                or data['begin'] != apm.stop_time_begin or data['finish'] != apm.stop_time_finish:
+            am_edit_msg = check_stop_window(data['begin'], data['finish'], flight['departing_at'],
+                                            flight['arriving_at'], airport, airline, used, stop_reg)
+        if am_edit_msg != 'success':
+            return sts_msg, am_edit_msg, am_msg
+        used.add(airport.id)
+
+    for data in new_stops:
+        if not (data['name'] and data['begin'] and data['finish']):
+            am_msg = 'Thông tin trạm dừng chưa được điền đầy đủ'
+        else:
+            am_msg = check_stop_window(data['begin'], data['finish'], flight['departing_at'],
+                                       flight['arriving_at'], airports.get(data['airport']),
+                                       airline, used, stop_reg)
+        if am_msg != 'success':
+            return sts_msg, am_edit_msg, am_msg
+        used.add(airports[data['airport']].id)
+
+    old_id = model.id
+    plane_changed = flight['plane'] != model.plane_id
+    try:
+        for apm, data in edits:
+            apm.name = data['name']
+            apm.stop_time_begin = data['begin']
+            apm.stop_time_finish = data['finish']
+            apm.description = data['description']
+            apm.airport_medium_id = airports[data['airport']].id
+
+        for data in new_stops:
+            airport_id = airports[data['airport']].id
+            db.session.add(Flight_AirportMedium(name=data['name'], stop_time_begin=data['begin'],
+                                                stop_time_finish=data['finish'],
+                                                description=data['description'],
+                                                flight_id=old_id, airport_medium_id=airport_id))
+            for r in stop_reg:
+                db.session.add(FA_Regulation(flight_id=old_id, airport_id=airport_id, regulation_id=r))
+        db.session.flush()
+
+        model.id = flight['id']
+        model.name = flight['name']
+        model.departing_at = flight['departing_at']
+        model.arriving_at = flight['arriving_at']
+        model.plane_id = flight['plane']
+        model.airline_id = airline.id
+        db.session.flush()
+
+        if model.id != old_id:
+            # CSDL khong bat khoa ngoai (SQLite) thi tu chuyen tram dung va ghe sang ma moi
+            for m in (Flight_AirportMedium, Seat, FlightAvailability, SeatHold):
+                m.query.filter(m.flight_id.__eq__(old_id)) \
+                    .update({m.flight_id: model.id}, synchronize_session=False)
+
+        if plane_changed and not db.session.query(func.sum(FlightAvailability.sold + FlightAvailability.held)) \
+                .filter(FlightAvailability.flight_id.__eq__(model.id)).scalar():
+            # doi may bay khi chua ban ve: tao lai so do ghe theo may bay moi
+            Seat.query.filter(Seat.flight_id.__eq__(model.id)).delete(synchronize_session=False)
+            FlightAvailability.query.filter(FlightAvailability.flight_id.__eq__(model.id)) \
+                .delete(synchronize_session=False)
+            build_seat_maps(db.session, [model.id])
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return 'Đã có lỗi xảy ra khi cập nhật chuyến bay! Vui lòng quay lại sau!', am_edit_msg, am_msg
+
+    return sts_msg, am_edit_msg, am_msg
+
+
 def cart_stats(cart):
     total_amount, total_quantity = 0, 0
 
     if cart:
         for c in cart.values():
-            total_quantity += c['quantity']
-            total_amount += c['quantity'] * c['price']
+            total_quantity += c.get('quantity', 1)
+            total_amount += c.get('quantity', 1) * c['price']
 
     return {
         'total_amount': total_amount,
@@ -229,18 +664,91 @@ def cart_stats(cart):
 
 
 
+@read_replica
 def load_airlines():
     return AirLine.query.all()
 
 
+@read_replica
 def load_airplanes():
     return AirPlane.query.all()
 
 
-def load_flights():
-    return Flight.query.all()
+@read_replica
+def load_flights(profile=None, channel=None):
+    # channel: chi lay cac chuyen bay con mo ban cho kenh do (xem SALE_CHANNELS)
+    query = flight_query(profile)
+    if channel:
+        query = query.filter(sale_closes_column(channel) > datetime.now())
+    return query.all()
+
+
+def encode_cursor(flight):
+    raw = '%s|%s' % (flight.departing_at.isoformat(), flight.id)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        departing_at, flight_id = raw.split('|', 1)
+        return datetime.fromisoformat(departing_at), flight_id
+    except (ValueError, UnicodeError):
+        return None
+
+
+def search_flights_statement(from_airport_id=None, to_airport_id=None, date_from=None, date_to=None,
+                             kw=None, cursor=None, page_size=20, channel=None):
+    # dung chung cho API dong bo va API bat dong bo (app/asgi.py); lay them 1 dong de biet con trang sau
+    query = db.select(Flight).join(Flight.airlines).options(contains_eager(Flight.airlines))
+
+    if channel:
+        query = query.where(sale_closes_column(channel) > datetime.now())
+
+    if from_airport_id:
+        query = query.where(AirLine.from_airport_id.__eq__(from_airport_id))
+
+    if to_airport_id:
+        query = query.where(AirLine.to_airport_id.__eq__(to_airport_id))
+
+    if date_from:
+        query = query.where(Flight.departing_at >= date_from)
+
+    if date_to:
+        query = query.where(Flight.departing_at < date_to + timedelta(days=1))
+
+    if kw:
+        query = query.where(AirLine.name.contains(kw))
+
+    if cursor:
+        position = decode_cursor(cursor)
+        if position:
+            departing_at, flight_id = position
+            query = query.where(or_(Flight.departing_at > departing_at,
+                                    and_(Flight.departing_at == departing_at, Flight.id > flight_id)))
+
+    return query.order_by(Flight.departing_at, Flight.id).limit(page_size + 1)
+
+
+def flight_page(flights, page_size):
+    next_cursor = None
+    if len(flights) > page_size:
+        flights = flights[:page_size]
+        next_cursor = encode_cursor(flights[-1])
+
+    return flights, next_cursor
+
 
+@read_replica
+def search_flights(from_airport_id=None, to_airport_id=None, date_from=None, date_to=None,
+                   kw=None, cursor=None, page_size=20, channel=None):
+    # loc bang SQL, phan trang theo (departing_at, id) thay vi OFFSET
+    query = search_flights_statement(from_airport_id, to_airport_id, date_from, date_to, kw, cursor,
+                                     page_size, channel)
+    return flight_page(db.session.execute(query).scalars().all(), page_size)
 
+
+@read_replica
 def load_tickets():
     return PlaneTicket.query.all()
 
@@ -281,50 +789,595 @@ def get_to_airport_by_id(to_airport_id):
     return AirLine.query.get(to_airport_id)
 
 
-def get_flight_by_id(flight_id):
-    return Flight.query.get(flight_id)
+@read_replica
+def get_flight_by_id(flight_id, profile=None):
+    return flight_query(profile).get(flight_id)
 
 
 def auth_user(username, password):
-    password = str(hashlib.md5(password.strip().encode('utf-8')).hexdigest())
-    return User.query.filter(User.username.__eq__(username.strip()),
-                             User.password.__eq__(password)).first()
+    return check_login(username, password)
+
+
+
+
+
+
+
+def get_seat_layouts(conn, plane_ids):
+    # {plane_id: [CabinLayout]}; may bay chua co so do thi tao mac dinh theo total_seat
+    layouts = {}
+    for r in conn.execute(db.select(SeatLayout.plane_id, SeatLayout.rank, SeatLayout.first_row, SeatLayout.rows,
+                                    SeatLayout.columns, SeatLayout.seats)
+                          .where(SeatLayout.plane_id.in_(plane_ids))
+                          .order_by(SeatLayout.plane_id, SeatLayout.rank)):
+        layouts.setdefault(r[0], []).append(seatmap.CabinLayout(*r[1:]))
+
+    missing = [p for p in plane_ids if p not in layouts]
+    if missing:
+        rows = []
+        for plane_id, total_seat in conn.execute(db.select(AirPlane.id, AirPlane.total_seat)
+                                                 .where(AirPlane.id.in_(missing))):
+            layouts[plane_id] = seatmap.default_layouts(total_seat)
+            rows.extend(dict(l._asdict(), plane_id=plane_id) for l in layouts[plane_id])
+        if rows:
+            try:
+                with conn.begin_nested():
+                    conn.execute(SeatLayout.__table__.insert(), rows)
+            except IntegrityError:
+                # tien trinh khac vua tao so do cho cung may bay
+                return get_seat_layouts(conn, plane_ids)
+    return layouts
+
+
+def build_seat_maps(conn, flight_ids=None):
+    # tao ghe cho chuyen bay theo so do may bay (chen mot lan cho ca lo), khong commit
+    # ghe cu chua co vi tri duoc xep vao cac cho dau tien, ghe da ban giu nguyen
+    flights = db.select(Flight.id, Flight.plane_id)
+    if flight_ids is not None:
+        flights = flights.where(Flight.id.in_(flight_ids))
+    flights = conn.execute(flights).all()
+    if not flights:
+        return 0
+
+    ids = [f[0] for f in flights]
+    layouts = get_seat_layouts(conn, {f[1] for f in flights})
+    existing = {}
+    for seat_id, flight_id, rank, position, status, held in conn.execute(
+            db.select(Seat.id, Seat.flight_id, Seat.rank, Seat.position, Seat.status, SeatHold.seat_id)
+            .outerjoin(SeatHold, SeatHold.seat_id.__eq__(Seat.id))
+            .where(Seat.flight_id.in_(ids)).order_by(Seat.id)):
+        existing.setdefault((flight_id, rank), []).append([seat_id, position, status, held])
+
+    new_seats, positioned, availability, ranks = [], [], [], set()
+    for flight_id, plane_id in flights:
+        for layout in layouts.get(plane_id, []):
+            seats = existing.get((flight_id, layout.rank), [])
+            used = {s[1] for s in seats if s[1] is not None}
+            free = (p for p in range(layout.seats) if p not in used)
+            taken = held = 0
+            for s in seats:
+                if s[1] is None:
+                    s[1] = next(free, None)
+                    if s[1] is None:
+                        continue
+                    positioned.append({'seat_id': s[0], 'seat_position': s[1],
+                                       'seat_name': layout.seat_name(s[1])})
+                if s[2] or s[3]:
+                    taken |= 1 << s[1]
+                    held += 0 if s[2] else 1
+            new_seats.extend({'name': layout.seat_name(p), 'status': False, 'rank': layout.rank,
+                              'position': p, 'flight_id': flight_id} for p in free)
+            availability.append({'flight_id': flight_id, 'rank': layout.rank, 'capacity': layout.seats,
+                                 'sold': bin(taken).count('1') - held, 'held': held,
+                                 'seat_bitmap': seatmap.to_bytes(taken, layout.seats)})
+            ranks.add(layout.rank)
+
+    if positioned:
+        conn.execute(Seat.__table__.update().where(Seat.id.__eq__(bindparam('seat_id')))
+                     .values(position=bindparam('seat_position'), name=bindparam('seat_name')), positioned)
+    if new_seats:
+        conn.execute(Seat.__table__.insert(), new_seats)
+    conn.execute(FlightAvailability.__table__.delete().where(FlightAvailability.flight_id.in_(ids),
+                                                             FlightAvailability.rank.in_(ranks)))
+    if availability:
+        conn.execute(FlightAvailability.__table__.insert(), availability)
+    return len(new_seats)
+
+
+def lock_seat_maps(flight_id, rank=None):
+    # khoa dong so do ghe (flight_id, hang) cho den het giao dich; hang pho thong truoc
+    query = db.session.query(FlightAvailability.rank, FlightAvailability.seat_bitmap) \
+        .filter(FlightAvailability.flight_id.__eq__(flight_id))
+    if rank:
+        query = query.filter(FlightAvailability.rank.__eq__(rank))
+    return query.order_by(FlightAvailability.rank.desc()).with_for_update().all()
+
+
+def flight_layouts(flight_id):
+    rows = db.session.query(SeatLayout.rank, SeatLayout.first_row, SeatLayout.rows, SeatLayout.columns,
+                            SeatLayout.seats) \
+        .join(Flight, Flight.plane_id.__eq__(SeatLayout.plane_id)) \
+        .filter(Flight.id.__eq__(flight_id)).all()
+    return {r[0]: seatmap.CabinLayout(*r) for r in rows}
+
+
+def save_seat_map(flight_id, rank, raw, taken, sold=0, held=0):
+    # raw: bitmap cu, giu nguyen do dai
+    FlightAvailability.query.filter(FlightAvailability.flight_id.__eq__(flight_id),
+                                    FlightAvailability.rank.__eq__(rank)) \
+        .update({FlightAvailability.seat_bitmap: taken.to_bytes(len(raw), 'little'),
+                 FlightAvailability.sold: FlightAvailability.sold + sold,
+                 FlightAvailability.held: FlightAvailability.held + held}, synchronize_session=False)
+
+
+def pick_seats(flight_id, quantity, rank=None):
+    # khoa so do ghe va chon ghe tren bitmap (uu tien ngoi canh nhau), chua danh dau gi
+    # tra ve (hang, bitmap cu, bitmap moi, danh sach id ghe) hoac None neu khong du ghe trong
+    layouts = flight_layouts(flight_id)
+    maps = lock_seat_maps(flight_id, rank)
+    if not layouts or not maps or any(m.seat_bitmap is None for m in maps):
+        # chuyen bay chua co so do ghe (du lieu cu): tao ngay trong giao dich nay
+        try:
+            with db.session.begin_nested():
+                build_seat_maps(db.session, [flight_id])
+        except IntegrityError:
+            # giao dich khac vua tao xong
+            pass
+        layouts = flight_layouts(flight_id)
+        maps = lock_seat_maps(flight_id, rank)
+
+    for m in maps:
+        layout = layouts.get(m.rank)
+        if layout is None:
+            continue
+        taken = seatmap.from_bytes(m.seat_bitmap)
+        positions = seatmap.find_seats(layout, taken, quantity)
+        if positions:
+            ids = [i for i, in db.session.query(Seat.id).filter(Seat.flight_id.__eq__(flight_id),
+                                                                 Seat.rank.__eq__(m.rank),
+                                                                 Seat.position.in_(positions))
+                   .order_by(Seat.position).all()]
+            return m.rank, m.seat_bitmap, seatmap.set_bits(taken, positions), ids
 
+    return None
 
 
+def take_seats(flight_id, quantity, rank=None):
+    # ban ghe trong giao dich hien tai, khong commit
+    # tra ve None neu bang ghe lech voi bitmap (can chay reconcile), [] neu khong du ghe trong
+    picked = pick_seats(flight_id, quantity, rank)
+    if picked is None:
+        return []
 
+    rank, raw, taken, ids = picked
+    updated = Seat.query.filter(Seat.id.in_(ids), Seat.status.__eq__(False)) \
+        .update({Seat.status: True}, synchronize_session=False)
+    if updated != quantity:
+        return None
 
+    save_seat_map(flight_id, rank, raw, taken, sold=quantity)
+    return ids
+
+
+def hold_seats(hold_code, flight_id, quantity=1, rank=None, ttl=None, retries=5):
+    # giu ghe cho gio ve trong ttl giay; ghe van trong (status False) nhung bit da bat
+    ttl = ttl or app.config['HOLD_TTL']
+    for i in range(retries):
+        try:
+            picked = pick_seats(flight_id, quantity, rank)
+            if picked is None:
+                db.session.rollback()
+                return []
+            rank_picked, raw, taken, ids = picked
+            if len(ids) != quantity:
+                db.session.rollback()
+                return []
+            expires_at = datetime.now() + timedelta(seconds=ttl)
+            db.session.execute(SeatHold.__table__.insert(), [{
+                'seat_id': seat_id,
+                'hold_code': hold_code,
+                'flight_id': flight_id,
+                'rank': rank_picked,
+                'expires_at': expires_at
+            } for seat_id in ids])
+            save_seat_map(flight_id, rank_picked, raw, taken, held=quantity)
+            db.session.commit()
+            return ids
+        except (OperationalError, IntegrityError):
+            # ghe dang bi giu/ban lech voi bitmap hoac khoa cheo -> thu lai
+            db.session.rollback()
+
+    return []
+
+
+def convert_holds(hold_code, seat_ids):
+    # chuyen ghe dang giu thanh ghe da ban trong giao dich thanh toan, khong commit
+    # ghe da bi sweeper tra lai thi khong con trong ket qua
+    groups = {}
+    for seat_id, flight_id, rank in db.session.query(SeatHold.seat_id, SeatHold.flight_id, SeatHold.rank) \
+            .filter(SeatHold.seat_id.in_(seat_ids), SeatHold.hold_code.__eq__(hold_code)).all():
+        groups.setdefault((flight_id, rank), []).append(seat_id)
+
+    converted = []
+    for (flight_id, rank), ids in sorted(groups.items()):
+        maps = lock_seat_maps(flight_id, rank)
+        # doc lai sau khi khoa: sweeper co the vua xoa
+        ids = [i for i, in db.session.query(SeatHold.seat_id)
+               .filter(SeatHold.seat_id.in_(ids), SeatHold.hold_code.__eq__(hold_code)).all()]
+        if not ids or not maps:
+            continue
+        SeatHold.query.filter(SeatHold.seat_id.in_(ids)).delete(synchronize_session=False)
+        Seat.query.filter(Seat.id.in_(ids)).update({Seat.status: True}, synchronize_session=False)
+        raw = maps[0].seat_bitmap
+        save_seat_map(flight_id, rank, raw, seatmap.from_bytes(raw), sold=len(ids), held=-len(ids))
+        converted.extend(ids)
+
+    return converted
+
+
+def release_expired_holds(batch_size=200, now=None):
+    # tra cac ghe het han giu theo lo, moi lo mot giao dich ngan; tra ve so ghe da tra
+    now = now or datetime.now()
+    released = 0
+    while True:
+        rows = db.session.query(SeatHold.seat_id, SeatHold.flight_id, SeatHold.rank) \
+            .filter(SeatHold.expires_at <= now) \
+            .order_by(SeatHold.expires_at).limit(batch_size).all()
+        if not rows:
+            break
+
+        groups = {}
+        for seat_id, flight_id, rank in rows:
+            groups.setdefault((flight_id, rank), []).append(seat_id)
+
+        try:
+            for (flight_id, rank), ids in sorted(groups.items()):
+                maps = lock_seat_maps(flight_id, rank)
+                expired = db.session.query(SeatHold.seat_id, Seat.position) \
+                    .join(Seat, Seat.id.__eq__(SeatHold.seat_id)) \
+                    .filter(SeatHold.seat_id.in_(ids), SeatHold.expires_at <= now).all()
+                if not expired:
+                    continue
+                SeatHold.query.filter(SeatHold.seat_id.in_([e[0] for e in expired])) \
+                    .delete(synchronize_session=False)
+                if maps and maps[0].seat_bitmap is not None:
+                    raw = maps[0].seat_bitmap
+                    taken = seatmap.clear_bits(seatmap.from_bytes(raw), [e[1] for e in expired])
+                    save_seat_map(flight_id, rank, raw, taken, held=-len(expired))
+                released += len(expired)
+            db.session.commit()
+        except OperationalError:
+            db.session.rollback()
+            break
+
+        if len(rows) < batch_size:
+            break
+
+    return released
+
+
+def release_seats(seat_ids):
+    # tra ghe khi huy ve, khong commit; khoa so do ghe truoc (cung thu tu voi take_seats)
+    groups = {}
+    for flight_id, rank, position in db.session.query(Seat.flight_id, Seat.rank, Seat.position) \
+            .filter(Seat.id.in_(seat_ids), Seat.status.__eq__(True)).all():
+        groups.setdefault((flight_id, rank), []).append(position)
+
+    released = 0
+    for (flight_id, rank), positions in sorted(groups.items()):
+        maps = lock_seat_maps(flight_id, rank)
+        n = Seat.query.filter(Seat.id.in_(seat_ids), Seat.flight_id.__eq__(flight_id),
+                              Seat.rank.__eq__(rank), Seat.status.__eq__(True)) \
+            .update({Seat.status: False}, synchronize_session=False)
+        if maps and maps[0].seat_bitmap is not None:
+            taken = seatmap.clear_bits(seatmap.from_bytes(maps[0].seat_bitmap),
+                                       [p for p in positions if p is not None])
+            save_seat_map(flight_id, rank, maps[0].seat_bitmap, taken, -n)
+        released += n
+
+    return released
+
+
+def claim_seats(flight_id, quantity=1, rank=None, retries=5):
+    if not flight_id or quantity < 1:
+        return []
+
+    for i in range(retries):
+        try:
+            ids = take_seats(flight_id, quantity, rank)
+            if ids is None:
+                db.session.rollback()
+                continue
+            db.session.commit()
+        except OperationalError:
+            # khoa/deadlock giua cac giao dich dat ghe -> thu lai
+            db.session.rollback()
+            continue
+
+        if ids:
+            return Seat.query.filter(Seat.id.in_(ids)).order_by(Seat.id).all()
+        return []
+
+    return []
+
+
+def remaining_seats(flight_id):
+    return db.session.query(func.count(Seat.id)).filter(Seat.flight_id.__eq__(flight_id),
+                                                         Seat.status.__eq__(False)).scalar()
 
 
 def seat(flight_id=None): #khach dky ghe thanh cong
-    if flight_id:
-        seats = Seat.query.filter(Seat.flight_id.__eq__(flight_id)).all()
-        for s in seats:
-            if not s.status:
-                return s
+    seats = claim_seats(flight_id, 1)
+    if seats:
+        return seats[0]
     return None
 
 
 def ts(flight_id=None):  # fligt - > air
     if flight_id:
-        amountUsed = Seat.query.filter(Seat.flight_id.__eq__(flight_id),
-                                       Seat.status.__eq__(True)).all()
+        total_seat = db.session.query(AirPlane.total_seat) \
+            .join(Flight, Flight.plane_id.__eq__(AirPlane.id)) \
+            .filter(Flight.id.__eq__(flight_id)).scalar()
+        amount_used = db.session.query(func.count(Seat.id)).filter(Seat.flight_id.__eq__(flight_id),
+                                                                   Seat.status.__eq__(True)).scalar()
+        if total_seat is not None:
+            return total_seat - amount_used
+    return 0
+
+
+def availability_statement(flight_ids):
+    return db.select(FlightAvailability).where(FlightAvailability.flight_id.in_(flight_ids))
+
+
+def group_availability(rows):
+    availability = {}
+    for a in rows:
+        availability.setdefault(a.flight_id, {})[a.rank] = a.available()
+    return availability
+
+
+def get_availability(flight_ids):
+    # {flight_id: {rank: so ghe con trong}} bang mot lan doc
+    if not flight_ids:
+        return {}
+    return group_availability(db.session.execute(availability_statement(flight_ids)).scalars().all())
+
+
+def reconcile_availability(flight_ids=None):
+    # tinh lai bo dem va bitmap tu bang ghe, tra ve cac dong bi lech
+    seats = db.session.query(Seat.flight_id, Seat.rank, Seat.position, Seat.status, SeatHold.seat_id) \
+        .outerjoin(SeatHold, SeatHold.seat_id.__eq__(Seat.id))
+    summaries = FlightAvailability.query
+    if flight_ids:
+        seats = seats.filter(Seat.flight_id.in_(flight_ids))
+        summaries = summaries.filter(FlightAvailability.flight_id.in_(flight_ids))
+
+    existing = {(a.flight_id, a.rank): a for a in summaries.with_for_update().all()}
+    counts = {}
+    for flight_id, rank, position, status, held in seats.all():
+        c = counts.setdefault((flight_id, rank), [0, 0, 0, 0])
+        c[0] += 1
+        if status:
+            c[1] += 1
+        elif held:
+            c[2] += 1
+        if (status or held) and position is not None:
+            c[3] |= 1 << position
+
+    repaired = []
+    for (flight_id, rank), (capacity, sold, held, taken) in counts.items():
+        a = existing.pop((flight_id, rank), None)
+        if a is None:
+            a = FlightAvailability(flight_id=flight_id, rank=rank, capacity=0, sold=0, held=0)
+            db.session.add(a)
+        bitmap = seatmap.to_bytes(taken, capacity)
+        if a.capacity != capacity or a.sold != sold or a.held != held or a.seat_bitmap != bitmap:
+            repaired.append((flight_id, rank, a.capacity, a.sold, capacity, sold))
+            a.capacity = capacity
+            a.sold = sold
+            a.held = held
+            a.seat_bitmap = bitmap
+
+    for a in existing.values():
+        if a.capacity or a.sold or a.held:
+            repaired.append((a.flight_id, a.rank, a.capacity, a.sold, 0, 0))
+            a.capacity = a.sold = a.held = 0
+            a.seat_bitmap = None
 
-    fl = AirPlane.query.get(Flight.query.get(flight_id).plane_id)
-    return fl.total_seat - amountUsed
+    db.session.commit()
+    return repaired
+
+
+def seat_map_statement(flight_id):
+    return db.select(FlightAvailability.rank, FlightAvailability.capacity, FlightAvailability.sold,
+                     FlightAvailability.held, FlightAvailability.seat_bitmap, SeatLayout.first_row, SeatLayout.rows,
+                     SeatLayout.columns) \
+        .join(Flight, Flight.id.__eq__(FlightAvailability.flight_id)) \
+        .join(SeatLayout, and_(SeatLayout.plane_id.__eq__(Flight.plane_id),
+                               SeatLayout.rank.__eq__(FlightAvailability.rank))) \
+        .where(FlightAvailability.flight_id.__eq__(flight_id)) \
+        .order_by(FlightAvailability.rank)
+
+
+def seat_map_data(rows):
+    return [{
+        'rank': r.rank,
+        'first_row': r.first_row,
+        'rows': r.rows,
+        'columns': r.columns,
+        'seats': r.capacity,
+        'available': r.capacity - r.sold - r.held,
+        'taken': seatmap.encode(r.seat_bitmap)
+    } for r in rows]
+
+
+@read_replica
+def get_seat_map(flight_id):
+    # so do ghe cua chuyen bay trong mot lan doc: moi hang mot bitmap ghe da ban (base64)
+    return seat_map_data(db.session.execute(seat_map_statement(flight_id)).all())
+
+
+def get_rank_price(rank):
+    price = regulation_cache.get_by_name(str(rank))
+    if isinstance(price, Decimal):
+        return price
+    return None
 
 
-def save_receipt(cart):
-    if cart:
-        p = Profile(user=current_user)
-        db.session.add(p)
+def add_to_cart(cart, flight_id, rank, name, dob, email, phone, cccd='', gender='nam', hold=False,
+                channel='customer'):
+    # hold=True: giu truoc mot ghe cho hanh khach, het HOLD_TTL chua thanh toan thi ghe duoc tra lai
+    price = get_rank_price(rank)
+    if not (flight_id and name and dob and email and phone) or price is None:
+        return None
+    if hold and check_sale_window([flight_id], channel) != 'success':
+        return None
 
-        for c in cart.values():
-            pt = PlaneTicket(rank=c['rank'], price=c['price'], seat_id=c['seat'],
-                             place=c['from'] + c['to'], profile=p)
-            db.session.add(pt)
+    hold_code = seat_id = None
+    if hold:
+        hold_code = next((c['hold_code'] for c in cart.values() if c.get('hold_code')), None) or uuid.uuid4().hex
+        seats = hold_seats(hold_code, flight_id, 1, int(rank))
+        if not seats:
+            return None
+        seat_id = seats[0]
+
+    key = str(max([int(k) for k in cart.keys()] or [0]) + 1)
+    cart[key] = {
+        'hold_code': hold_code,
+        'seat_id': seat_id,
+        'flight_id': flight_id,
+        'rank': int(rank),
+        'price': float(price),
+        'id': cccd,
+        'name': name,
+        'gender': gender,
+        'dob': dob,
+        'email': email,
+        'phone': phone
+    }
+    return cart
+
+
+def validate_cart(cart):
+    for c in cart.values():
+        price = get_rank_price(c['rank'])
+        if price is None:
+            return 'Chưa có quy định giá cho hạng vé %s' % c['rank']
+        if Decimal(str(c['price'])) != price:
+            return 'Giá vé không đúng quy định của hạng vé %s' % c['rank']
+    return 'success'
+
+
+def write_booking(items, flights, booking_code, user=None):
+    # khong commit; tra ve None neu bi giao dich khac gianh ghe
+    # ghe dang giu cho gio ve duoc chuyen thanh ghe ban, ghe giu da het han thi chon ghe moi
+    seats = {}
+    holds = {}
+    for i, c in enumerate(items):
+        if c.get('hold_code') and c.get('seat_id'):
+            holds.setdefault(c['hold_code'], []).append(i)
+    for hold_code, indexes in holds.items():
+        converted = set(convert_holds(hold_code, [items[i]['seat_id'] for i in indexes]))
+        seats.update((i, items[i]['seat_id']) for i in indexes if items[i]['seat_id'] in converted)
+
+    groups = {}
+    for i, c in enumerate(items):
+        if i not in seats:
+            groups.setdefault((c['flight_id'], c['rank']), []).append(i)
+
+    for (flight_id, rank), indexes in sorted(groups.items()):
+        ids = take_seats(flight_id, len(indexes), rank)
+        if ids is None:
+            return None
+        if not ids:
+            return 'Chuyến bay %s không còn đủ ghế hạng %s' % (flight_id, rank), []
+        seats.update(zip(indexes, ids))
+
+    db.session.execute(Profile.__table__.insert(), [{
+        'id': c.get('id', ''),
+        'name': c['name'],
+        'gender': c.get('gender', 'nam'),
+        'dob': datetime.strptime(c['dob'], '%Y-%m-%d'),
+        'email': c['email'],
+        'phone': c['phone'],
+        'isSupervisor': False,
+        'booking_code': booking_code
+    } for c in items])
+    serials = [s for s, in db.session.query(Profile.serial)
+               .filter(Profile.booking_code.__eq__(booking_code)).order_by(Profile.serial).all()]
+
+    now = datetime.now()
+    db.session.execute(PlaneTicket.__table__.insert(), [{
+        'rank': c['rank'],
+        'price': get_rank_price(c['rank']),
+        'date': now,
+        'booking_code': booking_code,
+        'place': flights[c['flight_id']][1],
+        'profile_id': serials[i],
+        'flight_id': c['flight_id'],
+        'seat_id': seats[i],
+        'user_id': user.id if user else None
+    } for i, c in enumerate(items)])
+    tickets = db.session.query(PlaneTicket.id, PlaneTicket.rank) \
+        .filter(PlaneTicket.booking_code.__eq__(booking_code)).order_by(PlaneTicket.id).all()
+
+    db.session.execute(ticket_regulation.insert(), [{
+        'ticket_id': ticket_id,
+        'regulation_id': regulation_cache.get_id(str(rank))
+    } for ticket_id, rank in tickets])
+
+    add_revenue([(now, flights[c['flight_id']][2], c['flight_id'], get_rank_price(c['rank'])) for c in items])
+
+    return 'success', [t[0] for t in tickets]
+
+
+def checkout(cart, user=None, retries=5):
+    # tra ve (msg, booking_code, danh sach id ve), moi thu trong mot giao dich
+    if not cart:
+        return 'Giỏ vé đang trống', None, []
+
+    msg = validate_cart(cart)
+    if msg != 'success':
+        return msg, None, []
+
+    items = list(cart.values())
+    flight_ids = {c['flight_id'] for c in items}
+    flights = {f[0]: f for f in db.session.query(Flight.id, AirLine.from_airport_id, Flight.airline_id)
+               .join(AirLine, AirLine.id.__eq__(Flight.airline_id))
+               .filter(Flight.id.in_(flight_ids)).all()}
+    if len(flights) != len(flight_ids):
+        return 'Chuyến bay không tồn tại', None, []
+
+    msg = check_sale_window(flight_ids, sale_channel(user))
+    if msg != 'success':
+        return msg, None, []
+
+    for i in range(retries):
+        booking_code = uuid.uuid4().hex
+        try:
+            result = write_booking(items, flights, booking_code, user)
+            if result is None:
+                db.session.rollback()
+                continue
+            msg, tickets = result
+            if msg != 'success':
+                db.session.rollback()
+                return msg, None, []
+            db.session.commit()
+            return msg, booking_code, tickets
+        except OperationalError:
+            db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    return 'Hệ thống đang bận! Vui lòng thử lại sau!', None, []
 
-        db.session.commit()
+
+def save_receipt(cart):
+    if current_user and current_user.is_authenticated:
+        return checkout(cart, current_user)
+    return checkout(cart)
 
 
 # def count_result_by_airline():
@@ -334,6 +1387,7 @@ def save_receipt(cart):
 #         .group_by(AirLine.id).order_by(AirLine.id).all()
 
 
+@read_replica
 def load_search_airport(kw=None, from_airport_id=None, to_airport_id=None):
     query = db.session.query(AirLine.id, AirLine.name, AirLine.from_airport_id, AirLine.to_airport_id) \
         .join(AirPort, AirPort.id.__eq__(AirLine.from_airport_id)) \
@@ -351,16 +1405,122 @@ def load_search_airport(kw=None, from_airport_id=None, to_airport_id=None):
     return query.all()
 
 
-def statistic_revenue_follow_month(airline_name=None, date=None):
-    stats = db.session.query(AirLine.id, AirLine.name, func.sum(PlaneTicket.price), func.count(Flight.id.distinct())) \
-        .join(Flight, Flight.airline_id.__eq__(AirLine.id), isouter=True) \
-        .join(PlaneTicket, PlaneTicket.flight_id.__eq__(Flight.id), isouter=True) \
-        .group_by(AirLine.id, AirLine.name)
-
-    if airline_name and date:
-        date = datetime.strptime(date, "%Y-%m")
+def upsert_increment(table, rows, keys, columns):
+    # INSERT ... ON DUPLICATE/ON CONFLICT cong don vao dong da co
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table)
+        stmt = stmt.on_duplicate_key_update({c: table.c[c] + stmt.inserted[c] for c in columns})
+    else:
+        stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=keys,
+                                          set_={c: table.c[c] + stmt.excluded[c] for c in columns})
+    db.session.execute(stmt, rows)
+
+
+def add_revenue(sales):
+    # sales: [(ngay ban, airline_id, flight_id, gia ve)], chay trong giao dich ban ve
+    rows = {}
+    for date, airline_id, flight_id, price in sales:
+        key = (date.date(), airline_id, flight_id)
+        if key not in rows:
+            rows[key] = {'day': key[0], 'airline_id': airline_id, 'flight_id': flight_id,
+                         'revenue': Decimal(0), 'tickets': 0}
+        rows[key]['revenue'] += price
+        rows[key]['tickets'] += 1
+
+    if rows:
+        upsert_increment(RevenueRollup.__table__, list(rows.values()),
+                         ['day', 'airline_id', 'flight_id'], ['revenue', 'tickets'])
+
+
+def revenue_rollup_rebuild_statement():
+    day = func.date(PlaneTicket.date)
+    sales = db.select(day, Flight.airline_id, PlaneTicket.flight_id,
+                      func.sum(PlaneTicket.price), func.count(PlaneTicket.id)) \
+        .join(Flight, Flight.id.__eq__(PlaneTicket.flight_id)) \
+        .group_by(day, Flight.airline_id, PlaneTicket.flight_id)
+    return RevenueRollup.__table__.insert().from_select(
+        ['day', 'airline_id', 'flight_id', 'revenue', 'tickets'], sales)
+
+
+def rebuild_revenue_rollup():
+    db.session.execute(RevenueRollup.__table__.delete())
+    db.session.execute(revenue_rollup_rebuild_statement())
+    db.session.commit()
+    return db.session.query(func.count()).select_from(RevenueRollup).scalar()
+
+
+@read_replica
+def statistic_revenue(airline_name=None, from_date=None, to_date=None):
+    # doc tu bang tong hop theo ngay, to_date tinh ca ngay cuoi
+    if from_date or to_date:
+        sales = db.session.query(RevenueRollup.airline_id.label('airline_id'),
+                                 func.sum(RevenueRollup.revenue).label('revenue'),
+                                 func.count(RevenueRollup.flight_id.distinct()).label('flights'),
+                                 func.sum(RevenueRollup.tickets).label('tickets'))
+        if from_date:
+            sales = sales.filter(RevenueRollup.day >= from_date)
+        if to_date:
+            sales = sales.filter(RevenueRollup.day <= to_date)
+        sales = sales.group_by(RevenueRollup.airline_id).subquery()
+        stats = db.session.query(AirLine.id, AirLine.name, sales.c.revenue, sales.c.flights, sales.c.tickets) \
+            .join(sales, sales.c.airline_id.__eq__(AirLine.id))
+    else:
+        sales = db.session.query(RevenueRollup.airline_id.label('airline_id'),
+                                 func.sum(RevenueRollup.revenue).label('revenue'),
+                                 func.sum(RevenueRollup.tickets).label('tickets')) \
+            .group_by(RevenueRollup.airline_id).subquery()
+        flights = db.session.query(Flight.airline_id.label('airline_id'),
+                                   func.count(Flight.id).label('flights')) \
+            .group_by(Flight.airline_id).subquery()
+        stats = db.session.query(AirLine.id, AirLine.name, sales.c.revenue,
+                                 func.coalesce(flights.c.flights, 0), func.coalesce(sales.c.tickets, 0)) \
+            .outerjoin(sales, sales.c.airline_id.__eq__(AirLine.id)) \
+            .outerjoin(flights, flights.c.airline_id.__eq__(AirLine.id))
+
+    if airline_name:
         stats = stats.filter(AirLine.name.contains(airline_name))
-        stats = stats.filter(extract('year', PlaneTicket.date) == date.year,
-                             extract('month', PlaneTicket.date) == date.month)
 
-    return stats.all()
\ No newline at end of file
+    return stats.order_by(AirLine.id).all()
+
+
+def statistic_revenue_follow_month(airline_name=None, date=None):
+    if airline_name and date:
+        date = datetime.strptime(date, "%Y-%m").date()
+        last_day = datetime(date.year + date.month // 12, date.month % 12 + 1, 1).date() - timedelta(days=1)
+        return statistic_revenue(airline_name=airline_name, from_date=date, to_date=last_day)
+
+    return statistic_revenue()
+
+
+def revenue_export_statement(airline_name=None, from_date=None, to_date=None):
+    # doanh thu chi tiet theo ngay va chuyen bay de xuat file (app/exports.py), to_date tinh ca ngay cuoi
+    query = db.select(RevenueRollup.day, AirLine.id, AirLine.name, RevenueRollup.flight_id,
+                      RevenueRollup.tickets, RevenueRollup.revenue) \
+        .join(AirLine, AirLine.id.__eq__(RevenueRollup.airline_id))
+    if airline_name:
+        query = query.where(AirLine.name.contains(airline_name))
+    if from_date:
+        query = query.where(RevenueRollup.day >= from_date)
+    if to_date:
+        query = query.where(RevenueRollup.day <= to_date)
+    return query.order_by(RevenueRollup.day, AirLine.id, RevenueRollup.flight_id)
+
+
+def tickets_export_statement(airline_name=None, from_date=None, to_date=None):
+    # danh sach ve da ban kem hanh khach, loc theo ngay ban
+    query = db.select(PlaneTicket.id, PlaneTicket.booking_code, PlaneTicket.date, Flight.id, Flight.name,
+                      AirLine.name, Seat.name, PlaneTicket.rank, PlaneTicket.price,
+                      Profile.name, Profile.id, Profile.email, Profile.phone) \
+        .join(Profile, Profile.serial.__eq__(PlaneTicket.profile_id)) \
+        .join(Flight, Flight.id.__eq__(PlaneTicket.flight_id)) \
+        .join(AirLine, AirLine.id.__eq__(Flight.airline_id)) \
+        .outerjoin(Seat, Seat.id.__eq__(PlaneTicket.seat_id))
+    if airline_name:
+        query = query.where(AirLine.name.contains(airline_name))
+    if from_date:
+        query = query.where(PlaneTicket.date >= from_date)
+    if to_date:
+        query = query.where(PlaneTicket.date < to_date + timedelta(days=1))
+    return query.order_by(PlaneTicket.id)
@@ -0,0 +1,218 @@
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+from urllib.parse import quote
+from flask import current_app, g, has_request_context, session as cookie_session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from flask_sqlalchemy.session import Session
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    # thoi gian cho lay ket noi va muc do day cua pool, theo tung engine
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, wait, timed_out=False):
+        with self._lock:
+            s = self._stats.setdefault(name, {'checkouts': 0, 'timeouts': 0, 'wait_total': 0.0, 'wait_max': 0.0})
+            if timed_out:
+                s['timeouts'] += 1
+            else:
+                s['checkouts'] += 1
+            s['wait_total'] += wait
+            s['wait_max'] = max(s['wait_max'], wait)
+
+    def stats(self, engines):
+        result = {}
+        for key, engine in engines.items():
+            name = key or 'primary'
+            pool = engine.pool
+            with self._lock:
+                s = dict(self._stats.get(name, {'checkouts': 0, 'timeouts': 0, 'wait_total': 0.0, 'wait_max': 0.0}))
+            s['wait_avg'] = s['wait_total'] / s['checkouts'] if s['checkouts'] else 0.0
+            if isinstance(pool, QueuePool):
+                capacity = pool.size() + pool._max_overflow
+                s.update({
+                    'size': pool.size(),
+                    'max_overflow': pool._max_overflow,
+                    'checked_out': pool.checkedout(),
+                    'idle': pool.checkedin(),
+                    'saturation': pool.checkedout() / float(capacity) if capacity > 0 else 0.0
+                })
+            result[name] = s
+        return result
+
+
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    # do thoi gian cho ket noi; het pool_timeout thi tinh la timeout
+    metrics_name = 'primary'
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            pool_metrics.observe(self.metrics_name, time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.observe(self.metrics_name, time.perf_counter() - start)
+        return conn
+
+
+def timed_pool(name):
+    return type('TimedQueuePool', (TimedQueuePool,), {'metrics_name': name})
+
+
+def env_int(environ, name, default):
+    value = environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def env_bool(environ, name, default):
+    value = environ.get(name)
+    if value in (None, ''):
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_url(environ):
+    # DATABASE_URL > DB_ENGINE=sqlite (chay thu) > MySQL tu cac bien DB_*
+    if environ.get('DATABASE_URL'):
+        return environ['DATABASE_URL']
+    if environ.get('DB_ENGINE', 'mysql') == 'sqlite':
+        return 'sqlite:///' + environ.get('DB_SQLITE_PATH', os.path.join(os.path.dirname(__file__), 'qlcb.db'))
+    return 'mysql+pymysql://%s:%s@%s/%s?charset=utf8mb4' % (
+        environ.get('DB_USER', 'root'),
+        quote(environ.get('DB_PASSWORD', 'phantan0106')),
+        environ.get('DB_HOST', 'localhost'),
+        environ.get('DB_NAME', 'project_btl'))
+
+
+def engine_options(environ, url, name='primary'):
+    if url.startswith('sqlite'):
+        return {}
+    return {
+        'poolclass': timed_pool(name),
+        'pool_size': env_int(environ, 'DB_POOL_SIZE', 10),
+        'max_overflow': env_int(environ, 'DB_MAX_OVERFLOW', 20),
+        'pool_timeout': env_int(environ, 'DB_POOL_TIMEOUT', 10),
+        # MySQL dong ket noi ranh sau wait_timeout (mac dinh 8 gio)
+        'pool_recycle': env_int(environ, 'DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': env_bool(environ, 'DB_POOL_PRE_PING', True)
+    }
+
+
+ASYNC_DRIVERS = {
+    'mysql+pymysql': 'mysql+aiomysql',
+    'mysql': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg'
+}
+
+
+def async_database_url(environ=None):
+    # API bat dong bo (app/asgi.py) doc tu ban sao neu co, doi driver sang ban async tuong ung
+    environ = os.environ if environ is None else environ
+    if environ.get('ASYNC_DATABASE_URL'):
+        return environ['ASYNC_DATABASE_URL']
+    url = environ.get('DATABASE_REPLICA_URL') or database_url(environ)
+    scheme, rest = url.split('://', 1)
+    return '%s://%s' % (ASYNC_DRIVERS.get(scheme, scheme), rest)
+
+
+def async_engine_options(environ, url):
+    options = engine_options(environ, url, 'async')
+    # engine async dung pool rieng (AsyncAdaptedQueuePool)
+    options.pop('poolclass', None)
+    return options
+
+
+def database_config(environ=None):
+    environ = os.environ if environ is None else environ
+    url = database_url(environ)
+    config = {
+        'SQLALCHEMY_DATABASE_URI': url,
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options(environ, url),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SQLALCHEMY_BINDS': {}
+    }
+    replica = environ.get('DATABASE_REPLICA_URL')
+    if replica:
+        options = engine_options(environ, replica, 'replica')
+        options['url'] = replica
+        config['SQLALCHEMY_BINDS']['replica'] = options
+    return config
+
+
+# pysqlite chi mo giao dich truoc cau ghi dau tien nen cau doc (vd bitmap ghe) khong nam trong giao dich;
+# tu mo giao dich tu cau dau tien de hai yeu cau dong thoi khong cung ban mot ghe
+@event.listens_for(Engine, 'connect')
+def sqlite_autocommit(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.isolation_level = None
+
+
+@event.listens_for(Engine, 'begin')
+def sqlite_begin(conn):
+    if conn.dialect.name == 'sqlite' and conn.dialect.driver == 'pysqlite':
+        conn.exec_driver_sql('BEGIN')
+
+
+class RoutingSession(Session):
+    # cac ham chi doc danh dau read_replica se doc tu ban sao (neu co cau hinh),
+    # ghi luon vao CSDL chinh; da ghi thi ca phien bam vao CSDL chinh
+    def use_replica(self, clause):
+        if not self.info.get('replica') or self.info.get('pinned') or self._flushing:
+            return False
+        if getattr(clause, '_for_update_arg', None) is not None:
+            return False
+        return 'replica' in self._db.engines
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.use_replica(clause):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def pin_to_primary(session, flush_context):
+    session.info['pinned'] = True
+    if has_request_context():
+        g.db_wrote = True
+
+
+def read_replica(f):
+    @wraps(f)
+    def decorated_func(*args, **kwargs):
+        session = current_app.extensions['sqlalchemy'].session()
+        previous = session.info.get('replica')
+        session.info['replica'] = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            session.info['replica'] = previous
+
+    return decorated_func
+
+
+def init_routing(app, db):
+    # doc-sau-ghi: trinh duyet vua ghi thi cac yeu cau trong REPLICA_STICKY_SECONDS tiep theo doc CSDL chinh
+    @app.before_request
+    def pin_recent_writer():
+        if 'replica' not in app.config['SQLALCHEMY_BINDS']:
+            return
+        wrote_at = cookie_session.get('db_wrote_at')
+        db.session().info['pinned'] = bool(wrote_at) and time.time() - wrote_at < app.config['REPLICA_STICKY_SECONDS']
+
+    @app.after_request
+    def remember_writer(response):
+        if g.get('db_wrote') and 'replica' in app.config['SQLALCHEMY_BINDS']:
+            cookie_session['db_wrote_at'] = time.time()
+        return response
@@ -0,0 +1,227 @@
+import csv
+import io
+import itertools
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+from flask import Response, stream_with_context
+from sqlalchemy.orm import Query
+from werkzeug.utils import secure_filename
+from app import app, db
+
+
+# xuat du lieu lon: doc bang con tro phia may chu theo lo (yield_per), ghi va gui tung doan,
+# bo nho khong tang theo so dong
+EXPORT_BATCH = 1000
+FLUSH_ROWS = 500
+LOG_EVERY = 100000
+
+
+class ExportProgress:
+    # tien do cac lan xuat gan day trong tien trinh nay, xem /api/admin/exports/<export_id>
+    def __init__(self, max_entries=100):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, name, total=None):
+        export_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[export_id] = {'name': name, 'total': total, 'rows': 0, 'bytes': 0,
+                                        'started_at': time.time(), 'finished_at': None, 'status': 'running'}
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return export_id
+
+    def advance(self, export_id, rows, size):
+        with self._lock:
+            entry = self._entries.get(export_id)
+            if entry:
+                entry['rows'] += rows
+                entry['bytes'] += size
+
+    def finish(self, export_id, status='done'):
+        with self._lock:
+            entry = self._entries.get(export_id)
+            if entry:
+                entry['status'] = status
+                entry['finished_at'] = time.time()
+
+    def get(self, export_id):
+        with self._lock:
+            entry = self._entries.get(export_id)
+            return dict(entry) if entry else None
+
+
+export_progress = ExportProgress()
+
+
+def iterate(query, batch_size=EXPORT_BATCH):
+    # Query cua ORM hoac cau select; stream_results: MySQL dung SSCursor thay vi nap het ket qua
+    if isinstance(query, Query):
+        return query.yield_per(batch_size)
+    return db.session.execute(query.execution_options(stream_results=True)).yield_per(batch_size)
+
+
+def text_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+class CsvWriter:
+    mimetype = 'text/csv'
+
+    def __init__(self):
+        # BOM de Excel doc dung tieng Viet
+        self.buffer = io.StringIO()
+        self.buffer.write('\ufeff')
+        self.writer = csv.writer(self.buffer)
+
+    def row(self, values):
+        self.writer.writerow([text_value(v) for v in values])
+
+    def flush(self):
+        data = self.buffer.getvalue().encode('utf-8')
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def close(self):
+        return self.flush()
+
+
+class ChunkBuffer:
+    # tep chi ghi cho zipfile: gom byte da ghi de gui di, khong seek nen zipfile ghi theo kieu luong
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+}
+
+
+class XlsxWriter:
+    # xlsx toi gian (mot trang tinh, chuoi inline) ghi truc tiep vao zip, khong can thu vien ngoai
+    mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    def __init__(self, sheet_name='Sheet1'):
+        self.out = ChunkBuffer()
+        self.zip = zipfile.ZipFile(self.out, 'w', zipfile.ZIP_DEFLATED)
+        for name, content in XLSX_PARTS.items():
+            if name == 'xl/workbook.xml':
+                content = content % escape(sheet_name[:31], {'"': '&quot;'})
+            self.zip.writestr(name, content)
+        self.sheet = self.zip.open('xl/worksheets/sheet1.xml', 'w')
+        self.sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                         b'<sheetData>')
+
+    def cell(self, value):
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            return '<c><v>%s</v></c>' % value
+        return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % escape(text_value(value))
+
+    def row(self, values):
+        self.sheet.write(('<row>%s</row>' % ''.join(self.cell(v) for v in values)).encode('utf-8'))
+
+    def flush(self):
+        return self.out.take()
+
+    def close(self):
+        self.sheet.write(b'</sheetData></worksheet>')
+        self.sheet.close()
+        self.zip.close()
+        return self.out.take()
+
+
+WRITERS = {
+    'csv': CsvWriter,
+    'xlsx': XlsxWriter
+}
+
+
+def stream_export(filename, titles, rows, export_type='csv', total=None):
+    # rows: iterator cac dong (list gia tri); tra ve Response gui dan, header X-Export-Id de theo doi tien do
+    writer = WRITERS[export_type]()
+    export_id = export_progress.start(filename, total)
+
+    def generate():
+        status = 'failed'
+        try:
+            writer.row(titles)
+            count = 0
+            for batch in iter(lambda: list(itertools.islice(rows, FLUSH_ROWS)), []):
+                for values in batch:
+                    writer.row(values)
+                data = writer.flush()
+                count += len(batch)
+                export_progress.advance(export_id, len(batch), len(data))
+                if count % LOG_EVERY < len(batch):
+                    app.logger.info('Xuất %s: %s/%s dòng', filename, count, total if total is not None else '?')
+                if data:
+                    yield data
+            data = writer.close()
+            export_progress.advance(export_id, 0, len(data))
+            status = 'done'
+            yield data
+        finally:
+            export_progress.finish(export_id, status)
+
+    return Response(stream_with_context(generate()), mimetype=writer.mimetype, headers={
+        'Content-Disposition': 'attachment;filename=%s' % secure_filename('%s.%s' % (filename, export_type)),
+        'X-Export-Id': export_id
+    })
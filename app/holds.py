@@ -0,0 +1,52 @@
+import threading
+from app import app, dao
+
+
+class HoldSweeper(threading.Thread):
+    # luong nen: dinh ky tra cac ghe giu da het han, moi lo mot giao dich ngan
+    def __init__(self, interval):
+        super().__init__(name='hold-sweeper', daemon=True)
+        self.interval = interval
+        self.runs = 0
+        self.released = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sweep()
+
+    def sweep(self):
+        with app.app_context():
+            try:
+                n = dao.release_expired_holds()
+            except Exception:
+                app.logger.exception('Lỗi khi trả ghế giữ chỗ hết hạn')
+                n = 0
+        self.runs += 1
+        self.released += n
+        return n
+
+    def stop(self):
+        self._stopped.set()
+
+
+sweeper = None
+_lock = threading.Lock()
+
+
+def start_sweeper():
+    global sweeper
+    interval = app.config.get('HOLD_SWEEP_INTERVAL')
+    if interval and sweeper is None:
+        with _lock:
+            if sweeper is None:
+                sweeper = HoldSweeper(interval)
+                sweeper.start()
+    return sweeper
+
+
+@app.before_request
+def ensure_sweeper():
+    # chi tien trinh phuc vu web moi chay luong nen, cac lenh jobs/migrations thi khong
+    if sweeper is None:
+        start_sweeper()
@@ -0,0 +1,216 @@
+import csv
+import io
+import json
+from datetime import datetime
+from app import db, dao
+from app.cache import response_cache
+from app.models import AirPlane, AirPort, AirLine, Flight, Flight_AirportMedium, FA_Regulation, flight_regulation
+from app.route_graph import route_graph
+
+
+BATCH_SIZE = 1000
+MAX_STOPS = 5
+
+
+def read_csv(stream):
+    # cot: id,name,departing_at,arriving_at,plane,airline[,stop1_airport,stop1_begin,stop1_finish,...]
+    for row in csv.DictReader(stream):
+        stops = []
+        for i in range(1, MAX_STOPS + 1):
+            airport = (row.get('stop%d_airport' % i) or '').strip()
+            if airport:
+                stops.append({
+                    'name': row.get('stop%d_name' % i) or 'Trạm dừng %d' % i,
+                    'airport': airport,
+                    'begin': row.get('stop%d_begin' % i),
+                    'finish': row.get('stop%d_finish' % i),
+                    'description': row.get('stop%d_description' % i)
+                })
+        row['stops'] = stops
+        yield row
+
+
+def read_json(stream):
+    for row in json.load(stream):
+        yield row
+
+
+def read_jsonl(stream):
+    # moi dong mot chuyen bay, doc dan khong nap ca tep
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def parse_time(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        return None
+
+
+def batches(rows, size=BATCH_SIZE):
+    batch = []
+    for number, row in enumerate(rows, start=1):
+        batch.append((number, row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ScheduleImporter:
+    def __init__(self):
+        self.planes = {p for p, in db.session.query(AirPlane.id).all()}
+        self.airlines = {a[0]: a[1:] for a in db.session.query(AirLine.name, AirLine.id,
+                                                                AirLine.from_airport_id,
+                                                                AirLine.to_airport_id).all()}
+        self.airports = dict(db.session.query(AirPort.name, AirPort.id).all())
+        self.duration = dao.regulation_cache.get_by_name('duration')
+        self.min_stop = dao.regulation_cache.get_by_name('min_stop')
+        self.max_stop = dao.regulation_cache.get_by_name('max_stop')
+        self.duration_id = dao.regulation_cache.get_id('duration')
+        self.sale_offsets = dao.sale_offsets()
+        self.stop_regulation_ids = [i for i in (dao.regulation_cache.get_id('min_stop'),
+                                                dao.regulation_cache.get_id('max_stop')) if i]
+        self.seen_ids = set()
+        self.imported = 0
+        self.errors = []
+
+    def check_stops(self, flight, airline, stops):
+        errors, parsed, used = [], [], set()
+        for s in stops:
+            begin, finish = parse_time(s.get('begin')), parse_time(s.get('finish'))
+            airport_id = self.airports.get((s.get('airport') or '').strip())
+            if not (begin and finish and airport_id):
+                errors.append('Thông tin trạm dừng chưa được điền đầy đủ')
+                continue
+            if self.min_stop is None or self.max_stop is None:
+                errors.append('Vui lòng thiết lập quy định về thời gian dừng tối thiểu và tối đa')
+            elif not self.min_stop <= finish - begin <= self.max_stop:
+                errors.append('Thời gian dừng không đúng quy định')
+            if not (begin > flight['departing_at'] and finish < flight['arriving_at']):
+                errors.append('Thời gian dừng không phù hợp với thời gian bay')
+            if airport_id in airline[1:]:
+                errors.append('Sân bay dừng đã thuộc tuyến bay')
+            elif airport_id in used:
+                errors.append('Sân bay này đã được chọn làm trung gian. Vui lòng chọn sân bay khác!')
+            used.add(airport_id)
+            parsed.append({
+                'name': s.get('name') or '',
+                'stop_time_begin': begin,
+                'stop_time_finish': finish,
+                'description': s.get('description'),
+                'flight_id': flight['id'],
+                'airport_medium_id': airport_id
+            })
+        return errors, parsed
+
+    def import_batch(self, batch):
+        flights, stops, errors = [], {}, {}
+
+        # kiem tra tung cot cho ca lo, khong truy van theo tung dong
+        for number, row in batch:
+            row_errors = []
+            flight_id = (row.get('id') or '').strip()
+            name = (row.get('name') or '').strip()
+            departing_at, arriving_at = parse_time(row.get('departing_at')), parse_time(row.get('arriving_at'))
+            plane = (row.get('plane') or '').strip()
+            airline = self.airlines.get((row.get('airline') or '').strip())
+
+            if not (flight_id and name and departing_at and arriving_at):
+                row_errors.append('Thông tin chuyến bay chưa được điền đầy đủ!')
+            elif len(flight_id) > 10 or len(name) > 50:
+                row_errors.append('Mã hoặc tên chuyến bay quá dài')
+            if flight_id in self.seen_ids:
+                row_errors.append('Mã chuyến bay bị trùng trong tệp')
+            if plane not in self.planes:
+                row_errors.append('Máy bay không tồn tại')
+            if airline is None:
+                row_errors.append('Tuyến bay không tồn tại')
+            if departing_at and arriving_at:
+                if self.duration is None:
+                    row_errors.append('Hiện chưa có quy định về thời gian bay tối thiểu')
+                elif (arriving_at - departing_at) <= self.duration:
+                    row_errors.append('Thời gian bay chưa đạt tối thiểu')
+
+            self.seen_ids.add(flight_id)
+            flight = {'id': flight_id, 'name': name, 'departing_at': departing_at,
+                      'arriving_at': arriving_at, 'plane_id': plane,
+                      'airline_id': airline[0] if airline else None}
+            if departing_at:
+                flight.update(dao.sale_windows(departing_at, self.sale_offsets))
+            if not row_errors:
+                stop_errors, stops[flight_id] = self.check_stops(flight, airline, row.get('stops') or [])
+                row_errors.extend(stop_errors)
+
+            if row_errors:
+                errors[number] = (flight_id, row_errors)
+            else:
+                flights.append((number, flight))
+
+        existing = {i for i, in db.session.query(Flight.id)
+                    .filter(Flight.id.in_([f['id'] for n, f in flights])).all()}
+        conflicts = dao.check_schedule_conflicts([{'id': f['id'], 'plane': f['plane_id'],
+                                                   'departing_at': f['departing_at'],
+                                                   'arriving_at': f['arriving_at']}
+                                                  for n, f in flights if f['id'] not in existing])
+
+        # trung lich trong tep: dong dung truoc duoc giu lai
+        valid, accepted = [], set()
+        for number, f in flights:
+            clashes = [c for c in conflicts.get(f['id'], []) if c not in conflicts or c in accepted]
+            if f['id'] in existing:
+                errors[number] = (f['id'], ['Mã chuyến bay đã tồn tại'])
+            elif clashes:
+                errors[number] = (f['id'], ['Máy bay đã có lịch bay trong khoảng thời gian này (%s)'
+                                            % ', '.join(clashes)])
+            else:
+                accepted.add(f['id'])
+                valid.append(f)
+
+        if valid:
+            db.session.execute(Flight.__table__.insert(), valid)
+            if self.duration_id:
+                db.session.execute(flight_regulation.insert(), [{'flight_id': f['id'],
+                                                                 'regulation_id': self.duration_id}
+                                                                for f in valid])
+            valid_stops = [s for f in valid for s in stops.get(f['id'], [])]
+            if valid_stops:
+                db.session.execute(Flight_AirportMedium.__table__.insert(), valid_stops)
+                if self.stop_regulation_ids:
+                    db.session.execute(FA_Regulation.__table__.insert(), [{
+                        'flight_id': s['flight_id'],
+                        'airport_id': s['airport_medium_id'],
+                        'regulation_id': r
+                    } for s in valid_stops for r in self.stop_regulation_ids])
+            dao.build_seat_maps(db.session, [f['id'] for f in valid])
+            db.session.commit()
+            route_graph.mark_dirty(*[f['id'] for f in valid])
+            self.imported += len(valid)
+
+        for number in sorted(errors):
+            flight_id, row_errors = errors[number]
+            self.errors.append({'row': number, 'id': flight_id, 'errors': row_errors})
+
+    def run(self, rows):
+        for batch in batches(rows):
+            self.import_batch(batch)
+        if self.imported:
+            response_cache.invalidate('flights')
+        return {
+            'imported': self.imported,
+            'failed': len(self.errors),
+            'errors': self.errors
+        }
+
+
+def import_schedule(stream, format='csv'):
+    if isinstance(stream.read(0), bytes):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    readers = {'csv': read_csv, 'json': read_json, 'jsonl': read_jsonl}
+    rows = readers[format](stream)
+    return ScheduleImporter().run(rows)
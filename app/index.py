@@ -1,5 +1,5 @@
 from flask import render_template, request, redirect
-from app import dao, app, login
+from app import dao, app, login, holds, metrics
 from flask_login import login_user, logout_user, current_user
 from app.decorators import anonymous_user
 from app.admin import *
@@ -13,11 +13,16 @@ app.add_url_rule('/register/', 'register', controller.register, methods=['get',
 app.add_url_rule('/api/admin/flights/new/', 'add-flight', controller.airports)
 app.add_url_rule('/booking', 'booking', controller.booking)
 app.add_url_rule('/api/search_booking', 'load-flight', controller.load_flights)
+app.add_url_rule('/api/itineraries', 'itineraries', controller.itineraries)
 app.add_url_rule('/booking_staff', 'booking_staff', controller.booking_staff)
 app.add_url_rule('/flight/<flight_id>', 'detail', controller.details)
+app.add_url_rule('/api/flight/<flight_id>/seats', 'seat-map', controller.seat_map)
 app.add_url_rule('/search_booking', 'search_booking', controller.search_booking)
-app.add_url_rule('/api/pay', 'pay', controller.pay)
+app.add_url_rule('/api/pay', 'pay', controller.pay, methods=['post'])
 app.add_url_rule('/pay', 'pay1', controller.pay1)
+app.add_url_rule('/api/admin/db', 'db-health', controller.db_health)
+app.add_url_rule('/metrics', 'metrics', controller.prometheus_metrics)
+app.add_url_rule('/api/admin/exports/<export_id>', 'export-status', controller.export_status)
 app.add_url_rule('/get_booking', 'get_booking', controller.get_booking, methods=['post'])
 
 
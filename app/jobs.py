@@ -0,0 +1,162 @@
+import sys
+from datetime import datetime
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import app, db, dao
+
+
+def reconcile():
+    for flight_id, rank, capacity, sold, new_capacity, new_sold in dao.reconcile_availability():
+        print('%s hạng %s: %s/%s -> %s/%s' % (flight_id, rank, sold, capacity, new_sold, new_capacity))
+
+
+def seatmaps(*flight_ids):
+    print('Đã tạo %s ghế' % dao.build_seat_maps(db.session, list(flight_ids) or None))
+    db.session.commit()
+
+
+def holds():
+    print('Đã trả %s ghế giữ chỗ hết hạn' % dao.release_expired_holds())
+
+
+def salewindows():
+    print('Đã tính lại hạn chót cho %s chuyến bay' % dao.refresh_sale_windows(since=False))
+    db.session.commit()
+
+
+def generate(flights='1000', tickets='5000', seed='0'):
+    # xoa CSDL dang cau hinh va tao du lieu gia lap, vd: python -m app.jobs generate 10000 50000
+    from app import synthetic
+
+    result = synthetic.generate(flights=int(flights), tickets=int(tickets), seed=int(seed))
+    print(', '.join('%s=%s' % (k, v) for k, v in result.items()))
+
+
+def rollup():
+    print('Đã tổng hợp lại %s dòng doanh thu' % dao.rebuild_revenue_rollup())
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def budgets():
+    from app import index
+
+    flight = dao.load_flights()[:1]
+    client = app.test_client()
+    failed = False
+
+    for url, budget in app.config['SQL_QUERY_BUDGETS'].items():
+        if '<flight_id>' in url:
+            if not flight:
+                continue
+            url = url.replace('<flight_id>', flight[0].id)
+        with count_queries() as statements:
+            client.get(url)
+        status = 'OK' if len(statements) <= budget else 'VƯỢT'
+        failed = failed or len(statements) > budget
+        print('%-4s %-30s %s/%s' % (status, url, len(statements), budget))
+
+    if failed:
+        sys.exit(1)
+
+
+@contextmanager
+def count_by_engine():
+    counts = {}
+
+    def counter(name):
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            counts[name] = counts.get(name, 0) + 1
+        return before_cursor_execute
+
+    listeners = [(engine, counter(key or 'primary')) for key, engine in db.engines.items()]
+    for engine, listener in listeners:
+        event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        yield counts
+    finally:
+        for engine, listener in listeners:
+            event.remove(engine, 'before_cursor_execute', listener)
+
+
+def routing():
+    # chay voi hai CSDL, vd: DB_ENGINE=sqlite DATABASE_REPLICA_URL=sqlite:////tmp/replica.db python -m app.jobs routing
+    from app import index
+
+    if 'replica' not in db.engines:
+        print('Chưa cấu hình DATABASE_REPLICA_URL')
+        sys.exit(1)
+    for key, engine in db.engines.items():
+        if engine.dialect.name == 'sqlite':
+            db.metadata.create_all(engine)
+
+    client = app.test_client()
+    username = 'routing-%s' % datetime.now().strftime('%H%M%S%f')
+    steps = [
+        ('GET /search_booking', lambda: client.get('/search_booking'), 'replica'),
+        ('POST /register/', lambda: client.post('/register/', data={'name': 'Routing', 'username': username,
+                                                                   'password': '1', 'confirm': '1'}), 'primary'),
+        ('GET /search_booking (vừa ghi)', lambda: client.get('/search_booking?after=write'), 'primary'),
+        ('GET /search_booking (trình duyệt khác)', lambda: app.test_client().get('/search_booking?other=1'), 'replica'),
+    ]
+
+    failed = False
+    for name, run, expected in steps:
+        with count_by_engine() as counts:
+            run()
+        used = sorted(counts)
+        ok = used == [expected]
+        failed = failed or not ok
+        print('%-4s %-40s %s' % ('OK' if ok else 'SAI', name, ', '.join('%s=%s' % (k, counts[k]) for k in used)))
+
+    if failed:
+        sys.exit(1)
+
+
+def import_flights(path=None, format=None):
+    from app import importer
+
+    if not path:
+        print('Cách dùng: python -m app.jobs import <tệp .csv|.json|.jsonl>')
+        sys.exit(1)
+
+    format = format or path.rsplit('.', 1)[-1].lower()
+    with open(path, encoding='utf-8-sig') as f:
+        report = importer.import_schedule(f, format)
+    for e in report['errors']:
+        print('Dòng %s (%s): %s' % (e['row'], e['id'], '; '.join(e['errors'])))
+    print('Đã nhập %s chuyến bay, %s dòng lỗi' % (report['imported'], report['failed']))
+
+
+JOBS = {
+    'reconcile': reconcile,
+    'seatmaps': seatmaps,
+    'holds': holds,
+    'salewindows': salewindows,
+    'rollup': rollup,
+    'budgets': budgets,
+    'import': import_flights,
+    'routing': routing,
+    'generate': generate
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in JOBS:
+        print('Cách dùng: python -m app.jobs [%s] [tham số]' % '|'.join(JOBS))
+        sys.exit(1)
+
+    with app.app_context():
+        JOBS[sys.argv[1]](*sys.argv[2:])
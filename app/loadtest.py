@@ -0,0 +1,349 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from urllib import error, parse, request as urlrequest
+
+
+# thu tai luong dat ve: moi phien (nguoi dung ao) dang nhap -> tim chuyen -> xem chi tiet -> giu ghe -> thanh toan
+# may chu phai dang chay san, vd:
+#   LOGIN_THROTTLE_IP=100000,1 python -m app.index
+#   python -m app.loadtest --url http://127.0.0.1:5000 --rate 20 --duration 60 --curve spike --flights S1
+STEPS = ('login', 'search', 'detail', 'get_booking', 'pay')
+PASSWORD = 'loadtest'
+
+
+def arrival_curve(spec, rate, duration):
+    # so phien moi bat dau moi giay theo thoi gian t (giay)
+    # constant | ramp | spike | step | cac diem "giay:toc do,..." noi thang giua cac diem
+    if spec == 'constant':
+        return lambda t: rate
+    if spec == 'ramp':
+        return lambda t: rate * min(1.0, t / duration)
+    if spec == 'spike':
+        # mo ban: luong nho, dot ngot tang gap 10 trong 1/6 thoi gian, roi giam lai
+        start, end = duration / 3.0, duration / 3.0 + max(1.0, duration / 6.0)
+        return lambda t: rate if start <= t < end else rate / 10.0
+    if spec == 'step':
+        return lambda t: rate * (min(3, int(4 * t / duration)) + 1) / 4.0
+
+    points = sorted((float(a), float(b)) for a, b in (p.split(':') for p in spec.split(',')))
+
+    def curve(t):
+        if t <= points[0][0]:
+            return points[0][1]
+        for (t1, r1), (t2, r2) in zip(points, points[1:]):
+            if t1 <= t < t2:
+                return r1 + (r2 - r1) * (t - t1) / (t2 - t1)
+        return points[-1][1]
+
+    return curve
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))] if ordered else None
+
+
+class Recorder:
+    # ket qua moi buoc: ok, rejected (het ghe, gio trong...), throttled (429), error (5xx, loi mang, sai trang thai)
+    def __init__(self):
+        self.latencies = {s: [] for s in STEPS}
+        self.outcomes = {s: {'ok': 0, 'rejected': 0, 'throttled': 0, 'error': 0} for s in STEPS}
+        self.confirmed = {}
+        self.sessions = {'started': 0, 'completed': 0, 'max_waiting': 0}
+        self.messages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, step, latency, outcome):
+        with self._lock:
+            self.latencies[step].append(latency)
+            self.outcomes[step][outcome] += 1
+
+    def message(self, text):
+        with self._lock:
+            self.messages[text] = self.messages.get(text, 0) + 1
+
+    def confirm(self, flight_id, rank, tickets):
+        with self._lock:
+            key = (flight_id, rank)
+            self.confirmed[key] = self.confirmed.get(key, 0) + tickets
+
+    def session(self, event):
+        with self._lock:
+            self.sessions[event] += 1
+
+    def waiting(self, submitted):
+        # so phien da den nhung chua co nguoi dung ao nao nhan
+        with self._lock:
+            self.sessions['max_waiting'] = max(self.sessions['max_waiting'], submitted - self.sessions['started'])
+
+
+class NoRedirect(urlrequest.HTTPRedirectHandler):
+    # giu nguyen 302 de do rieng tung buoc, khong tai them trang dich
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def classify(status, expect):
+    if status in expect:
+        return 'ok'
+    if status == 429:
+        return 'throttled'
+    return 'error'
+
+
+class VirtualUser:
+    def __init__(self, base_url, recorder, timeout=30, think=0.0, rng=None):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.think = think
+        self.rng = rng or random.Random()
+        self.opener = urlrequest.build_opener(urlrequest.HTTPCookieProcessor(CookieJar()), NoRedirect)
+
+    def call(self, path, data=None):
+        body = parse.urlencode(data).encode('utf-8') if data is not None else None
+        start = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + path, body, self.timeout) as r:
+                status, payload = r.status, r.read()
+        except error.HTTPError as e:
+            status, payload = e.code, e.read()
+        except (error.URLError, OSError):
+            status, payload = None, b''
+        return status, payload, time.perf_counter() - start
+
+    def step(self, name, path, data=None, expect=(200,)):
+        status, payload, latency = self.call(path, data)
+        outcome = classify(status, expect)
+        self.recorder.observe(name, latency, outcome)
+        if self.think:
+            time.sleep(self.rng.uniform(0, self.think))
+        return outcome, payload
+
+    def run(self, username, flights, rank, search):
+        outcome, _ = self.step('login', '/login/', {'username': username, 'password': PASSWORD}, expect=(302,))
+        if outcome != 'ok':
+            return
+
+        outcome, payload = self.step('search', '/api/search_booking?' + parse.urlencode(search))
+        if outcome != 'ok':
+            return
+        if not flights:
+            found = json.loads(payload.decode('utf-8')).get('flights', [])
+            flights = [f['id'] for f in found if f.get('available')]
+            if not flights:
+                self.recorder.message('Không tìm thấy chuyến bay còn ghế')
+                return
+        flight_id = self.rng.choice(flights)
+
+        outcome, _ = self.step('detail', '/flight/%s' % parse.quote(flight_id))
+        if outcome != 'ok':
+            return
+
+        n = self.rng.randrange(10 ** 8)
+        outcome, _ = self.step('get_booking', '/get_booking', {
+            'name': 'Khách thử tải %d' % n, 'birthday': '1990-01-01', 'sdt': '09%08d' % n,
+            'email': 'lt%d@example.com' % n, 'from': flight_id, 'rank': rank
+        }, expect=(302,))
+        if outcome != 'ok':
+            return
+
+        status, payload, latency = self.call('/api/pay', {})
+        outcome = classify(status, (200,))
+        result = {}
+        if outcome == 'ok':
+            try:
+                result = json.loads(payload.decode('utf-8'))
+            except ValueError:
+                outcome = 'error'
+        # /api/pay luon tra 200, trang thai that nam trong JSON
+        if result.get('status') == 200:
+            self.recorder.confirm(flight_id, rank, len(result.get('tickets', [])))
+        elif result.get('status') == 400:
+            outcome = 'rejected'
+            self.recorder.message(result.get('err_msg') or 'Không rõ lý do')
+        elif outcome == 'ok':
+            outcome = 'error'
+        self.recorder.observe('pay', latency, outcome)
+
+
+def register_accounts(base_url, count, prefix, workers=8):
+    # tao san tai khoan (khong tinh vao ket qua)
+    def register(i):
+        user = VirtualUser(base_url, None)
+        username = '%s%d' % (prefix, i)
+        status, payload, latency = user.call('/register/', {'name': 'Thử tải %d' % i, 'username': username,
+                                                            'password': PASSWORD, 'confirm': PASSWORD})
+        return username if status == 302 else None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [u for u in pool.map(register, range(count)) if u]
+
+
+def seats_before(base_url, flights):
+    # so ghe con trong truoc khi chay, de phat hien ban qua so ghe tu phia trinh duyet
+    available = {}
+    for flight_id in flights:
+        status, payload, latency = VirtualUser(base_url, None).call('/api/flight/%s/seats' % parse.quote(flight_id))
+        if status == 200:
+            for r in json.loads(payload.decode('utf-8')):
+                available[(flight_id, r['rank'])] = r['available']
+    return available
+
+
+def database_oversold(flight_ids):
+    # doi chieu trong CSDL (cung cau hinh moi truong voi may chu): so ve vuot suc chua va ghe bi ban hai lan
+    from sqlalchemy import func
+    from app import app, db
+    from app.models import PlaneTicket, FlightAvailability
+
+    with app.app_context():
+        tickets = db.session.query(PlaneTicket.flight_id, PlaneTicket.rank, func.count(PlaneTicket.id)) \
+            .group_by(PlaneTicket.flight_id, PlaneTicket.rank)
+        duplicated = db.session.query(PlaneTicket.seat_id).group_by(PlaneTicket.seat_id) \
+            .having(func.count(PlaneTicket.id) > 1)
+        if flight_ids:
+            tickets = tickets.filter(PlaneTicket.flight_id.in_(flight_ids))
+            duplicated = duplicated.filter(PlaneTicket.flight_id.in_(flight_ids))
+        capacity = {(f, r): c for f, r, c in db.session.query(FlightAvailability.flight_id, FlightAvailability.rank,
+                                                              FlightAvailability.capacity).all()}
+        over = {'%s/%s' % (f, r): n - capacity[(f, r)] for f, r, n in tickets.all()
+                if (f, r) in capacity and n > capacity[(f, r)]}
+        return {'over_capacity': over, 'double_sold_seats': duplicated.count()}
+
+
+def summarize(recorder, elapsed, available):
+    steps, total, errors = {}, 0, 0
+    for s in STEPS:
+        latencies, outcomes = recorder.latencies[s], recorder.outcomes[s]
+        count = len(latencies)
+        total += count
+        errors += outcomes['error']
+        steps[s] = dict(outcomes, count=count,
+                        error_rate=outcomes['error'] / float(count) if count else 0.0,
+                        p50_ms=latencies and percentile(latencies, 50) * 1000,
+                        p95_ms=latencies and percentile(latencies, 95) * 1000,
+                        p99_ms=latencies and percentile(latencies, 99) * 1000,
+                        max_ms=latencies and max(latencies) * 1000)
+
+    confirmed = sum(recorder.confirmed.values())
+    oversold = {'%s/%s' % k: n - available[k] for k, n in recorder.confirmed.items()
+                if k in available and n > available[k]}
+    return {
+        'elapsed_s': elapsed,
+        'sessions': recorder.sessions,
+        'requests': total,
+        'throughput_rps': total / elapsed if elapsed else 0.0,
+        'error_rate': errors / float(total) if total else 0.0,
+        'bookings': confirmed,
+        'bookings_per_s': confirmed / elapsed if elapsed else 0.0,
+        'oversold': oversold,
+        'rejections': recorder.messages,
+        'steps': steps
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.loadtest')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--duration', type=float, default=60, help='số giây tạo phiên mới')
+    parser.add_argument('--rate', type=float, default=10, help='số phiên mới mỗi giây (đỉnh của đường cong)')
+    parser.add_argument('--curve', default='constant',
+                        help='constant | ramp | spike | step | các điểm "giây:phiên/giây,...", vd 0:1,30:50,60:5')
+    parser.add_argument('--max-users', type=int, default=100, help='số người dùng ảo chạy đồng thời tối đa')
+    parser.add_argument('--accounts', type=int, default=50, help='số tài khoản tạo trước khi chạy')
+    parser.add_argument('--flights', help='mã chuyến bay mở bán, cách nhau bởi dấu phẩy; bỏ trống thì chọn từ kết quả tìm')
+    parser.add_argument('--rank', type=int, default=2)
+    parser.add_argument('--from-airport', type=int)
+    parser.add_argument('--to-airport', type=int)
+    parser.add_argument('--think', type=float, default=0.0, help='thời gian nghỉ tối đa (giây) giữa các bước')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db-check', action='store_true',
+                        help='đối chiếu vé bán quá số ghế trong CSDL (cùng biến môi trường DB_* với máy chủ)')
+    parser.add_argument('--out', help='ghi kết quả JSON')
+    args = parser.parse_args(argv)
+
+    flights = [f.strip() for f in (args.flights or '').split(',') if f.strip()]
+    search = {k: v for k, v in (('from_airport_id', args.from_airport), ('to_airport_id', args.to_airport),
+                                ('page_size', 20)) if v}
+    rng = random.Random(args.seed)
+    curve = arrival_curve(args.curve, args.rate, args.duration)
+
+    accounts = register_accounts(args.url, args.accounts, 'lt%s_' % uuid.uuid4().hex[:8])
+    if not accounts:
+        print('Không tạo được tài khoản thử tải tại %s' % args.url)
+        return 1
+    available = seats_before(args.url, flights)
+
+    recorder = Recorder()
+
+    def session(username, seed):
+        recorder.session('started')
+        try:
+            VirtualUser(args.url, recorder, args.timeout, args.think, random.Random(seed)) \
+                .run(username, flights, args.rank, search)
+        except Exception as e:
+            recorder.message('%s: %s' % (type(e).__name__, e))
+        finally:
+            recorder.session('completed')
+
+    # phien moi den theo qua trinh Poisson voi toc do curve(t); vuot max-users thi xep hang cho
+    submitted = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.max_users) as pool:
+        while True:
+            now = time.perf_counter() - start
+            rate = curve(now)
+            if rate <= 0:
+                time.sleep(0.05)
+            else:
+                time.sleep(rng.expovariate(rate))
+            if time.perf_counter() - start >= args.duration:
+                break
+            if rate > 0:
+                recorder.waiting(submitted)
+                pool.submit(session, accounts[submitted % len(accounts)], rng.randrange(2 ** 32))
+                submitted += 1
+    elapsed = time.perf_counter() - start
+
+    report = summarize(recorder, elapsed, available)
+    report['config'] = vars(args)
+    if args.db_check:
+        report['database'] = database_oversold(flights)
+
+    print('%d phiên, %d yêu cầu trong %.1fs: %.1f yêu cầu/giây, lỗi %.2f%%, %d vé (%.1f vé/giây)'
+          % (report['sessions']['completed'], report['requests'], elapsed, report['throughput_rps'],
+             report['error_rate'] * 100, report['bookings'], report['bookings_per_s']))
+    print('%-12s %7s %6s %8s %6s %6s %9s %9s %9s' % ('bước', 'số lần', 'ok', 'từ chối', '429', 'lỗi',
+                                                     'p50 ms', 'p95 ms', 'p99 ms'))
+    for s in STEPS:
+        r = report['steps'][s]
+        if r['count']:
+            print('%-12s %7d %6d %8d %6d %6d %9.1f %9.1f %9.1f' % (s, r['count'], r['ok'], r['rejected'],
+                                                                 r['throttled'], r['error'], r['p50_ms'],
+                                                                 r['p95_ms'], r['p99_ms']))
+    for text, n in sorted(report['rejections'].items(), key=lambda x: -x[1]):
+        print('  %5d x %s' % (n, text))
+    print('Bán quá số ghế (theo trình duyệt): %s' % (report['oversold'] or 0))
+    if 'database' in report:
+        print('Bán quá số ghế (CSDL): %s, ghế bán trùng: %s' % (report['database']['over_capacity'] or 0,
+                                                               report['database']['double_sold_seats']))
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    oversold = report['oversold'] or report.get('database', {}).get('over_capacity') \
+        or report.get('database', {}).get('double_sold_seats')
+    return 1 if oversold else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
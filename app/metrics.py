@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import app
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class EndpointStats:
+    __slots__ = ('count', 'errors', 'buckets', 'latency', 'sql_count', 'sql_time', 'sql_rows')
+
+    def __init__(self, size):
+        self.count = self.errors = self.sql_count = self.sql_rows = 0
+        self.latency = self.sql_time = 0.0
+        self.buckets = [0] * size
+
+
+class RequestMetrics:
+    # tong hop theo endpoint: do tre (histogram), so cau SQL, thoi gian SQL, so dong tra ve
+    def __init__(self, buckets=LATENCY_BUCKETS, slow_query=0.2, slow_log_size=100):
+        self.bucket_bounds = buckets
+        self.slow_query = slow_query
+        self.slow_total = {}
+        self._slow_log = deque(maxlen=slow_log_size)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, endpoint, latency, status, sql_count, sql_time, sql_rows):
+        with self._lock:
+            s = self._endpoints.get(endpoint)
+            if s is None:
+                s = self._endpoints[endpoint] = EndpointStats(len(self.bucket_bounds))
+            s.count += 1
+            s.latency += latency
+            if status >= 500:
+                s.errors += 1
+            for i, bound in enumerate(self.bucket_bounds):
+                if latency <= bound:
+                    s.buckets[i] += 1
+                    break
+            s.sql_count += sql_count
+            s.sql_time += sql_time
+            s.sql_rows += sql_rows
+
+    def observe_slow(self, endpoint, duration, statement):
+        app.logger.warning('Câu SQL chậm %.3fs tại %s: %s', duration, endpoint, statement[:1000])
+        with self._lock:
+            self.slow_total[endpoint] = self.slow_total.get(endpoint, 0) + 1
+            self._slow_log.append({
+                'at': time.time(),
+                'endpoint': endpoint,
+                'duration': duration,
+                'statement': statement[:1000]
+            })
+
+    def slow_queries(self):
+        with self._lock:
+            return list(self._slow_log)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: (s.count, s.errors, list(s.buckets), s.latency, s.sql_count, s.sql_time, s.sql_rows)
+                    for name, s in self._endpoints.items()}, dict(self.slow_total)
+
+
+request_metrics = RequestMetrics(app.config.get('METRICS_LATENCY_BUCKETS', LATENCY_BUCKETS),
+                                 app.config.get('SLOW_QUERY_SECONDS', 0.2))
+
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'background'
+
+
+@app.before_request
+def start_request_timer():
+    g.metrics_start = time.perf_counter()
+    g.sql_count, g.sql_time, g.sql_rows = 0, 0.0, 0
+
+
+@app.after_request
+def record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        request_metrics.observe_request(current_endpoint(), time.perf_counter() - start, response.status_code,
+                                        g.sql_count, g.sql_time, g.sql_rows)
+    return response
+
+
+# lang nghe moi engine (CSDL chinh va ban sao)
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get('query_start')
+    if not stack:
+        return
+    duration = time.perf_counter() - stack.pop()
+    if has_request_context() and 'sql_count' in g:
+        g.sql_count += 1
+        g.sql_time += duration
+        # pymysql doc het ket qua vao bo dem nen rowcount la so dong SELECT; sqlite tra ve -1
+        g.sql_rows += max(cursor.rowcount, 0)
+    if request_metrics.slow_query is not None and duration >= request_metrics.slow_query:
+        request_metrics.observe_slow(current_endpoint(), duration, statement)
+
+
+@event.listens_for(Engine, 'handle_error')
+def drop_query_timer(context):
+    # cau loi khong qua after_cursor_execute, bo moc thoi gian de khong lech cac cau sau
+    stack = context.connection.info.get('query_start') if context.connection is not None else None
+    if stack:
+        stack.pop()
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(extra=()):
+    # dinh dang van ban cua Prometheus; extra: [(ten, loai, mo ta, [(nhan, gia tri)])]
+    endpoints, slow = request_metrics.snapshot()
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            label_text = ','.join('%s="%s"' % (k, escape_label(v)) for k, v in labels)
+            lines.append('%s{%s} %s' % (name, label_text, repr(float(value))) if label_text
+                         else '%s %s' % (name, repr(float(value))))
+
+    lines.append('# HELP qlcb_request_duration_seconds Thời gian xử lý yêu cầu')
+    lines.append('# TYPE qlcb_request_duration_seconds histogram')
+    for name, (count, errors, buckets, latency, sql_count, sql_time, sql_rows) in sorted(endpoints.items()):
+        label, cumulative = escape_label(name), 0
+        for bound, n in zip(request_metrics.bucket_bounds, buckets):
+            cumulative += n
+            lines.append('qlcb_request_duration_seconds_bucket{endpoint="%s",le="%r"} %d'
+                         % (label, float(bound), cumulative))
+        lines.append('qlcb_request_duration_seconds_bucket{endpoint="%s",le="+Inf"} %d' % (label, count))
+        lines.append('qlcb_request_duration_seconds_sum{endpoint="%s"} %r' % (label, latency))
+        lines.append('qlcb_request_duration_seconds_count{endpoint="%s"} %d' % (label, count))
+
+    by_endpoint = sorted(endpoints.items())
+    family('qlcb_request_errors_total', 'counter', 'Số yêu cầu lỗi 5xx',
+           [([('endpoint', n)], row[1]) for n, row in by_endpoint])
+    family('qlcb_sql_statements_total', 'counter', 'Số câu SQL đã chạy',
+           [([('endpoint', n)], row[4]) for n, row in by_endpoint])
+    family('qlcb_sql_seconds_total', 'counter', 'Tổng thời gian chạy SQL',
+           [([('endpoint', n)], row[5]) for n, row in by_endpoint])
+    family('qlcb_sql_rows_total', 'counter', 'Số dòng SQL trả về',
+           [([('endpoint', n)], row[6]) for n, row in by_endpoint])
+    family('qlcb_sql_slow_queries_total', 'counter', 'Số câu SQL chậm hơn SLOW_QUERY_SECONDS',
+           [([('endpoint', n)], v) for n, v in sorted(slow.items())])
+
+    for name, kind, help_text, samples in extra:
+        family(name, kind, help_text, samples)
+    return '\n'.join(lines) + '\n'
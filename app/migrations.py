@@ -0,0 +1,162 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, func, inspect, case
+from sqlalchemy.schema import CreateColumn
+from app import app, db, dao
+from app.models import User, AirPort, AirLine, Flight, Seat, PlaneTicket, FlightAvailability, Profile, RevenueRollup, \
+    SeatLayout, SeatHold
+
+
+schema_version = db.Table('schema_version',
+    Column('version', Integer, primary_key=True),
+    Column('description', String(100), nullable=False),
+    Column('applied_at', DateTime, default=datetime.now)
+)
+
+
+def get_index(model, name):
+    for i in model.__table__.indexes:
+        if i.name == name:
+            return i
+    raise KeyError(name)
+
+
+def create_indexes(*indexes):
+    def run(conn):
+        for model, name in indexes:
+            get_index(model, name).create(conn, checkfirst=True)
+
+    return run
+
+
+def add_columns(model, *names):
+    def run(conn):
+        table = model.__table__
+        existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+        for name in names:
+            if name not in existing:
+                conn.exec_driver_sql('ALTER TABLE %s ADD COLUMN %s' % (
+                    conn.dialect.identifier_preparer.format_table(table),
+                    CreateColumn(table.c[name]).compile(dialect=conn.dialect)))
+
+    return run
+
+
+def alter_columns(model, *names):
+    # sqlite khong gioi han do dai chuoi nen bo qua
+    def run(conn):
+        table = model.__table__
+        preparer = conn.dialect.identifier_preparer
+        for name in names:
+            column = table.c[name]
+            sql_type = column.type.compile(dialect=conn.dialect)
+            if conn.dialect.name == 'mysql':
+                conn.exec_driver_sql('ALTER TABLE %s MODIFY %s' % (
+                    preparer.format_table(table), CreateColumn(column).compile(dialect=conn.dialect)))
+            elif conn.dialect.name == 'postgresql':
+                conn.exec_driver_sql('ALTER TABLE %s ALTER COLUMN %s TYPE %s' % (
+                    preparer.format_table(table), preparer.format_column(column), sql_type))
+
+    return run
+
+
+def create_tables(*models):
+    def run(conn):
+        for model in models:
+            model.__table__.create(conn, checkfirst=True)
+
+    return run
+
+
+def steps(*runs):
+    def run(conn):
+        for r in runs:
+            r(conn)
+
+    return run
+
+
+def fill_availability(conn):
+    counts = db.select(Seat.flight_id, Seat.rank, func.count(Seat.id),
+                       func.coalesce(func.sum(case((Seat.status.__eq__(True), 1), else_=0)), 0)) \
+        .group_by(Seat.flight_id, Seat.rank)
+    conn.execute(FlightAvailability.__table__.delete())
+    conn.execute(FlightAvailability.__table__.insert().from_select(
+        ['flight_id', 'rank', 'capacity', 'sold'], counts))
+
+
+# (phiên bản, mô tả, hàm nâng cấp) - chỉ thêm vào cuối danh sách
+MIGRATIONS = [
+    (1, 'Chỉ mục cho lịch bay, ghế, tuyến bay và vé', create_indexes(
+        (AirPort, 'ix_airports_name'),
+        (AirLine, 'ix_airlines_name'),
+        (AirLine, 'ix_airlines_route'),
+        (Flight, 'ix_flights_plane_departing'),
+        (Flight, 'ix_flights_airline_departing'),
+        (Flight, 'ix_flights_departing'),
+        (Seat, 'ix_seats_flight_status'),
+        (PlaneTicket, 'ix_tickets_date_flight'),
+        (PlaneTicket, 'ix_tickets_flight'),
+    )),
+    (2, 'Hạng ghế và bộ đếm ghế trống theo chuyến bay', steps(
+        add_columns(Seat, 'rank'),
+        create_tables(FlightAvailability),
+        fill_availability,
+    )),
+    (3, 'Mã đặt chỗ cho hồ sơ và vé', steps(
+        add_columns(Profile, 'booking_code'),
+        add_columns(PlaneTicket, 'booking_code'),
+        create_indexes(
+            (Profile, 'ix_profiles_booking_code'),
+            (PlaneTicket, 'ix_tickets_booking_code'),
+        ),
+    )),
+    (4, 'Bảng tổng hợp doanh thu theo ngày', steps(
+        create_tables(RevenueRollup),
+        lambda conn: conn.execute(dao.revenue_rollup_rebuild_statement()),
+    )),
+    (5, 'Mở rộng cột mật khẩu cho scrypt/PBKDF2', alter_columns(User, 'password')),
+    (6, 'Sơ đồ ghế theo máy bay và bitmap ghế theo chuyến bay', steps(
+        create_tables(SeatLayout),
+        add_columns(Seat, 'position'),
+        add_columns(FlightAvailability, 'seat_bitmap'),
+        create_indexes((Seat, 'ix_seats_position')),
+    )),
+    # tao so do ghe o day (can bang giu cho), chay lai cung khong sao voi CSDL da o phien ban 6
+    (7, 'Giữ chỗ có thời hạn và tạo sơ đồ ghế cho các chuyến bay', steps(
+        create_tables(SeatHold),
+        add_columns(FlightAvailability, 'held'),
+        lambda conn: dao.build_seat_maps(conn),
+    )),
+    (8, 'Hạn chót đặt vé / bán vé tính sẵn cho từng chuyến bay', steps(
+        add_columns(Flight, 'booking_closes_at', 'sale_closes_at'),
+        create_indexes(
+            (Flight, 'ix_flights_booking_closes'),
+            (Flight, 'ix_flights_sale_closes'),
+        ),
+        lambda conn: dao.refresh_sale_windows(conn, since=False),
+    )),
+]
+
+
+def current_version(conn):
+    schema_version.create(conn, checkfirst=True)
+    return conn.execute(db.select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade():
+    applied = []
+    with db.engine.begin() as conn:
+        version = current_version(conn)
+        for number, description, run in MIGRATIONS:
+            if number > version:
+                run(conn)
+                conn.execute(schema_version.insert().values(version=number, description=description,
+                                                            applied_at=datetime.now()))
+                applied.append(number)
+    return applied
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        for v in upgrade():
+            print('Đã nâng cấp lên phiên bản %s' % v)
@@ -1,10 +1,9 @@
 import string
-from sqlalchemy import Column, Integer, String, Boolean, DECIMAL, ForeignKey, DateTime, Enum, Text, subquery
+from sqlalchemy import Column, Integer, String, Boolean, DECIMAL, ForeignKey, LargeBinary, DateTime, Date, Enum, Text, Index, subquery
 from sqlalchemy.orm import relationship, backref
 from app import db, app
 from enum import Enum as UserEnum
 from flask_login import UserMixin
-import hashlib
 from datetime import datetime, time, timedelta
 
 
@@ -20,7 +19,7 @@ class User(db.Model, UserMixin):
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(50), nullable=False)
     username = Column(String(50), nullable=False, unique=True)
-    password = Column(String(50), nullable=False)
+    password = Column(String(255), nullable=False)
     active = Column(Boolean, default=True)
     joined_date = Column(DateTime, default=datetime.now())
     user_role = Column(Enum(UserRole), default=UserRole.USER)
@@ -40,6 +39,7 @@ class Profile(db.Model):
     email = Column(String(50), nullable=False)
     phone = Column(String(10), nullable=False)
     isSupervisor = Column(Boolean, default=False)
+    booking_code = Column(String(32), index=True)
 
     def __str__(self):
         return str(self.id)
@@ -58,8 +58,22 @@ class AirPlane(db.Model):
         return str(self.id)
 
 
+class SeatLayout(db.Model):
+    __tablename__ = 'seat_layouts'
+
+    plane_id = Column(String(10), ForeignKey(AirPlane.id, ondelete="CASCADE", onupdate="cascade"), primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    first_row = Column(Integer, nullable=False, default=1)
+    rows = Column(Integer, nullable=False)
+    columns = Column(String(20), nullable=False)
+    seats = Column(Integer, nullable=False)
+
+
 class AirPort(db.Model):
     __tablename__ = 'airports'
+    __table_args__ = (
+        Index('ix_airports_name', 'name'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(50), nullable=False)
@@ -72,6 +86,10 @@ class AirPort(db.Model):
 
 class AirLine(db.Model):
     __tablename__ = 'airlines'
+    __table_args__ = (
+        Index('ix_airlines_name', 'name'),
+        Index('ix_airlines_route', 'from_airport_id', 'to_airport_id'),
+    )
 
     id = Column(String(10), primary_key=True)
     name = Column(String(100), nullable=False)
@@ -96,11 +114,21 @@ flight_regulation = db.Table('flight_regulation',
 
 class Flight(db.Model):
     __tablename__ = 'flights'
+    __table_args__ = (
+        Index('ix_flights_plane_departing', 'plane_id', 'departing_at'),
+        Index('ix_flights_airline_departing', 'airline_id', 'departing_at'),
+        Index('ix_flights_departing', 'departing_at', 'id'),
+        Index('ix_flights_booking_closes', 'booking_closes_at'),
+        Index('ix_flights_sale_closes', 'sale_closes_at'),
+    )
 
     id = Column(String(10), primary_key=True)
     name = Column(String(50), nullable=False)
     departing_at = Column(DateTime, nullable=False)
     arriving_at = Column(DateTime, nullable=False)
+    # han dat ve online (departing_at - book_time) va han ban ve tai quay (departing_at - sale_time)
+    booking_closes_at = Column(DateTime)
+    sale_closes_at = Column(DateTime)
 
     plane_id = (Column(String(10), ForeignKey(AirPlane.id, ondelete="CASCADE", onupdate="cascade"), nullable=False))
     airline_id = (Column(String(10), ForeignKey(AirLine.id, ondelete="CASCADE", onupdate="cascade"), nullable=False))
@@ -109,7 +137,7 @@ class Flight(db.Model):
     airlines = relationship("AirLine", foreign_keys=[airline_id], lazy=True,
                             passive_deletes=True, cascade="all, delete")
 
-    regulations = relationship("Regulation", secondary=flight_regulation, lazy='subquery',
+    regulations = relationship("Regulation", secondary=flight_regulation, lazy=True,
                             backref=backref('regulations', lazy=True), passive_deletes=True, cascade="all, delete")
 
     def __str__(self):
@@ -118,10 +146,17 @@ class Flight(db.Model):
 
 class Seat(db.Model):
     __tablename__ = 'seats'
+    __table_args__ = (
+        Index('ix_seats_flight_status', 'flight_id', 'status'),
+        Index('ix_seats_position', 'flight_id', 'rank', 'position', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(50), nullable=False)
     status = Column(Boolean, default=False)
+    rank = Column(Integer, nullable=False, default=2, server_default='2')
+    # vi tri trong so do ghe cua hang (bit tuong ung trong FlightAvailability.seat_bitmap)
+    position = Column(Integer)
 
     flight_id = Column(String(10), ForeignKey(Flight.id, ondelete="CASCADE", onupdate="cascade"), nullable=False)
     flights = relationship("Flight", foreign_keys=[flight_id], lazy=True,
@@ -131,6 +166,35 @@ class Seat(db.Model):
         return str(self.id)
 
 
+class FlightAvailability(db.Model):
+    __tablename__ = 'flight_availability'
+
+    flight_id = Column(String(10), ForeignKey(Flight.id, ondelete="CASCADE", onupdate="cascade"), primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    capacity = Column(Integer, nullable=False, default=0)
+    sold = Column(Integer, nullable=False, default=0)
+    # ghe dang duoc giu cho trong gio ve (SeatHold), bit van bat trong seat_bitmap
+    held = Column(Integer, nullable=False, default=0, server_default='0')
+    seat_bitmap = Column(LargeBinary)
+
+    def available(self):
+        return self.capacity - self.sold - self.held
+
+
+class SeatHold(db.Model):
+    __tablename__ = 'seat_holds'
+    __table_args__ = (
+        Index('ix_seat_holds_expires', 'expires_at'),
+        Index('ix_seat_holds_code', 'hold_code'),
+    )
+
+    seat_id = Column(Integer, ForeignKey(Seat.id, ondelete="CASCADE"), primary_key=True)
+    hold_code = Column(String(32), nullable=False)
+    flight_id = Column(String(10), nullable=False)
+    rank = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
 class FA_Regulation(db.Model):
     flight_id = Column(String(10), ForeignKey('flight_airport_mediums.flight_id', ondelete="CASCADE",
                             onupdate="cascade"), primary_key=True)
@@ -174,11 +238,16 @@ ticket_regulation = db.Table('ticket_regulation',
 
 class PlaneTicket(db.Model):
     __tablename__ = 'tickets'
+    __table_args__ = (
+        Index('ix_tickets_date_flight', 'date', 'flight_id'),
+        Index('ix_tickets_flight', 'flight_id'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     rank = Column(Integer, nullable=False)
     price = Column(DECIMAL(18, 2), nullable=False)
     date = Column(DateTime, default=datetime.now())
+    booking_code = Column(String(32), index=True)
 
     place = Column(Integer, ForeignKey(AirPort.id, ondelete="CASCADE", onupdate="cascade"))
     profile_id = (Column(Integer, ForeignKey(Profile.serial, ondelete="CASCADE", onupdate="cascade"), nullable=False))
@@ -201,6 +270,16 @@ class PlaneTicket(db.Model):
         return str(self.id)
 
 
+class RevenueRollup(db.Model):
+    __tablename__ = 'revenue_daily'
+
+    day = Column(Date, primary_key=True)
+    airline_id = Column(String(10), ForeignKey(AirLine.id, ondelete="CASCADE", onupdate="cascade"), primary_key=True)
+    flight_id = Column(String(10), ForeignKey(Flight.id, ondelete="CASCADE", onupdate="cascade"), primary_key=True)
+    revenue = Column(DECIMAL(18, 2), nullable=False, default=0)
+    tickets = Column(Integer, nullable=False, default=0)
+
+
 class Regulation(db.Model):
     __tablename__ = 'regulations'
 
@@ -209,7 +288,7 @@ class Regulation(db.Model):
     value = Column(String(50), nullable=False)
     description = Column(Text)
 
-    tickets = relationship("PlaneTicket", secondary=ticket_regulation, lazy='subquery',
+    tickets = relationship("PlaneTicket", secondary=ticket_regulation, lazy=True,
                         backref=backref('tickets', lazy=True), passive_deletes=True, cascade="all, delete")
 
     def __str__(self):
@@ -225,7 +304,8 @@ if __name__ == '__main__':
         db.drop_all()
         db.create_all()
 
-        password = str(hashlib.md5('1'.encode('utf-8')).hexdigest())
+        from app.passwords import password_hasher
+        password = password_hasher.hash('1')
         u1 = User(name='Mai', username='mai', password=password,
                   user_role=UserRole.USER)
         u2 = User(name='Son', username='son', password=password,
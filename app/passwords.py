@@ -0,0 +1,200 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from app import app
+
+
+def b64encode(raw):
+    return base64.b64encode(raw).decode('ascii')
+
+
+def b64decode(text):
+    return base64.b64decode(text.encode('ascii'))
+
+
+class MD5Hasher:
+    # dinh dang cu: md5 hex khong muoi, chi dung de kiem tra va nang cap
+    algorithm = 'md5'
+
+    def identify(self, encoded):
+        return len(encoded) == 32 and '$' not in encoded
+
+    def encode(self, password):
+        return hashlib.md5(password.encode('utf-8')).hexdigest()
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(self.encode(password), encoded)
+
+    def must_update(self, encoded):
+        return True
+
+
+class PBKDF2Hasher:
+    # pbkdf2_sha256$so_vong$muoi$bam
+    algorithm = 'pbkdf2_sha256'
+
+    def __init__(self, iterations=600000):
+        self.iterations = iterations
+
+    def identify(self, encoded):
+        return encoded.startswith(self.algorithm + '$')
+
+    def derive(self, password, salt, iterations):
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+    def encode(self, password):
+        salt = os.urandom(16)
+        return '%s$%d$%s$%s' % (self.algorithm, self.iterations, b64encode(salt),
+                                b64encode(self.derive(password, salt, self.iterations)))
+
+    def verify(self, password, encoded):
+        try:
+            algorithm, iterations, salt, digest = encoded.split('$')
+            return hmac.compare_digest(self.derive(password, b64decode(salt), int(iterations)),
+                                       b64decode(digest))
+        except ValueError:
+            return False
+
+    def must_update(self, encoded):
+        return int(encoded.split('$')[1]) != self.iterations
+
+
+class ScryptHasher:
+    # scrypt$n$r$p$muoi$bam
+    algorithm = 'scrypt'
+
+    def __init__(self, n=2 ** 14, r=8, p=1):
+        self.n, self.r, self.p = n, r, p
+
+    def identify(self, encoded):
+        return encoded.startswith(self.algorithm + '$')
+
+    def derive(self, password, salt, n, r, p):
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r, dklen=32)
+
+    def encode(self, password):
+        salt = os.urandom(16)
+        return '%s$%d$%d$%d$%s$%s' % (self.algorithm, self.n, self.r, self.p, b64encode(salt),
+                                      b64encode(self.derive(password, salt, self.n, self.r, self.p)))
+
+    def verify(self, password, encoded):
+        try:
+            algorithm, n, r, p, salt, digest = encoded.split('$')
+            return hmac.compare_digest(self.derive(password, b64decode(salt), int(n), int(r), int(p)),
+                                       b64decode(digest))
+        except ValueError:
+            return False
+
+    def must_update(self, encoded):
+        return encoded.split('$')[1:4] != [str(self.n), str(self.r), str(self.p)]
+
+
+class PasswordHasher:
+    # hasher dau tien dung de bam mat khau moi, cac hasher con lai chi de kiem tra
+    def __init__(self, *hashers):
+        self.hashers = hashers
+        self.default = hashers[0]
+        self._dummy = None
+
+    def identify(self, encoded):
+        for h in self.hashers:
+            if encoded and h.identify(encoded):
+                return h
+        return None
+
+    def hash(self, password):
+        return self.default.encode(password.strip())
+
+    def verify(self, password, encoded):
+        # tra ve (dung/sai, chuoi bam moi neu can nang cap)
+        password = password.strip()
+        hasher = self.identify(encoded)
+        if hasher is None or not hasher.verify(password, encoded):
+            return False, None
+        if hasher is not self.default or hasher.must_update(encoded):
+            return True, self.default.encode(password)
+        return True, None
+
+    def dummy_verify(self, password):
+        # ten dang nhap khong ton tai van ton cung chi phi, tranh do ten qua thoi gian phan hoi
+        if self._dummy is None:
+            self._dummy = self.default.encode('dummy-password')
+        self.default.verify(password.strip(), self._dummy)
+
+
+def make_hasher(config):
+    hashers = {
+        'scrypt': ScryptHasher,
+        'pbkdf2_sha256': PBKDF2Hasher
+    }
+    name = config.get('PASSWORD_HASHER', 'scrypt')
+    if name == 'scrypt' and not hasattr(hashlib, 'scrypt'):
+        name = 'pbkdf2_sha256'
+    default = hashers[name]()
+    others = [cls() for key, cls in hashers.items() if key != name and (key != 'scrypt' or hasattr(hashlib, 'scrypt'))]
+    return PasswordHasher(default, *others, MD5Hasher())
+
+
+password_hasher = make_hasher(app.config)
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, capacity, now):
+        self.tokens = capacity
+        self.updated_at = now
+
+
+class LoginThrottle:
+    # moi khoa (ten dang nhap / dia chi IP) co mot xo token, het token thi tu choi ma khong cham CSDL
+    def __init__(self, capacity, period, max_keys=100000):
+        self.capacity = capacity
+        self.rate = capacity / float(period)
+        self.max_keys = max_keys
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.capacity, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated_at) * self.rate)
+            bucket.updated_at = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def consume(self, key):
+        with self._lock:
+            bucket = self._bucket(key, time.monotonic())
+            if bucket.tokens < 1:
+                self.rejected += 1
+                return False
+            bucket.tokens -= 1
+            return True
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+user_throttle = LoginThrottle(*app.config.get('LOGIN_THROTTLE_USER', (5, 300)))
+ip_throttle = LoginThrottle(*app.config.get('LOGIN_THROTTLE_IP', (30, 300)))
+
+
+def allow_login(username, ip):
+    username = (username or '').strip().lower()
+    return ip_throttle.consume(ip or '') and user_throttle.consume(username)
+
+
+def login_succeeded(username):
+    user_throttle.reset((username or '').strip().lower())
@@ -0,0 +1,168 @@
+import heapq
+import threading
+import time as clock
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from sqlalchemy import event, inspect
+from app import db
+from app.models import AirLine, Flight, Flight_AirportMedium
+
+
+Leg = namedtuple('Leg', ['departing_at', 'arriving_at', 'flight_id', 'from_airport_id', 'to_airport_id'])
+
+
+def flight_legs(flight_id, from_airport_id, to_airport_id, departing_at, arriving_at, stops):
+    # moi cap (len, xuong) tren cung mot chuyen bay la mot chang
+    # stops: [(airport_id, stop_time_begin, stop_time_finish)]
+    points = [(from_airport_id, departing_at, departing_at)]
+    points.extend(sorted(stops, key=lambda s: s[1]))
+    points.append((to_airport_id, arriving_at, arriving_at))
+
+    legs = []
+    for i in range(len(points)):
+        for j in range(i + 1, len(points)):
+            legs.append(Leg(points[i][2], points[j][1], flight_id, points[i][0], points[j][0]))
+    return legs
+
+
+class RouteGraph:
+    # do thi san bay -> cac chang bay sap xep theo gio khoi hanh, cap nhat theo chuyen bay thay doi
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.builds = 0
+        self.refreshes = 0
+        self._departures = {}
+        self._times = {}
+        self._legs_by_flight = {}
+        self._dirty = set()
+        self._stale = True
+        self._built_at = 0
+        self._lock = threading.RLock()
+
+    def _load(self, flight_ids=None):
+        since = datetime.combine(datetime.now().date(), time.min)
+        flights = db.session.query(Flight.id, AirLine.from_airport_id, AirLine.to_airport_id,
+                                   Flight.departing_at, Flight.arriving_at) \
+            .join(AirLine, AirLine.id.__eq__(Flight.airline_id)) \
+            .filter(Flight.departing_at >= since)
+        stops = db.session.query(Flight_AirportMedium.flight_id, Flight_AirportMedium.airport_medium_id,
+                                 Flight_AirportMedium.stop_time_begin, Flight_AirportMedium.stop_time_finish) \
+            .join(Flight, Flight.id.__eq__(Flight_AirportMedium.flight_id)) \
+            .filter(Flight.departing_at >= since)
+        if flight_ids is not None:
+            flights = flights.filter(Flight.id.in_(flight_ids))
+            stops = stops.filter(Flight_AirportMedium.flight_id.in_(flight_ids))
+
+        stops_by_flight = {}
+        for flight_id, airport_id, begin, finish in stops.all():
+            stops_by_flight.setdefault(flight_id, []).append((airport_id, begin, finish))
+
+        return {f[0]: flight_legs(*f, stops_by_flight.get(f[0], [])) for f in flights.all()}
+
+    def _add(self, flight_id, legs):
+        self._legs_by_flight[flight_id] = legs
+        for leg in legs:
+            departures = self._departures.setdefault(leg.from_airport_id, [])
+            times = self._times.setdefault(leg.from_airport_id, [])
+            i = bisect_left(departures, leg)
+            departures.insert(i, leg)
+            times.insert(i, leg.departing_at)
+
+    def _remove(self, flight_id):
+        for leg in self._legs_by_flight.pop(flight_id, []):
+            departures = self._departures[leg.from_airport_id]
+            i = bisect_left(departures, leg)
+            del departures[i]
+            del self._times[leg.from_airport_id][i]
+
+    def build(self):
+        with self._lock:
+            self._departures, self._times, self._legs_by_flight = {}, {}, {}
+            for flight_id, legs in self._load().items():
+                self._add(flight_id, legs)
+            self._dirty.clear()
+            self._stale = False
+            self._built_at = clock.monotonic()
+            self.builds += 1
+
+    def refresh(self):
+        with self._lock:
+            if self._stale or clock.monotonic() - self._built_at > self.ttl:
+                self.build()
+            elif self._dirty:
+                flight_ids = list(self._dirty)
+                self._dirty.clear()
+                loaded = self._load(flight_ids)
+                for flight_id in flight_ids:
+                    self._remove(flight_id)
+                    if flight_id in loaded:
+                        self._add(flight_id, loaded[flight_id])
+                self.refreshes += 1
+
+    def mark_dirty(self, *flight_ids):
+        with self._lock:
+            self._dirty.update(flight_ids)
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def search(self, origin, destination, date, max_connections=1,
+               min_connection=timedelta(minutes=45), limit=5, horizon=timedelta(days=2)):
+        self.refresh()
+
+        start = datetime.combine(date, time.min)
+        first_leg_end = start + timedelta(days=1)
+        deadline = start + horizon
+        heap = [(start, 0, origin, ())]
+        popped = {}
+        results = []
+
+        with self._lock:
+            while heap and len(results) < limit:
+                arrival, n, airport, path = heapq.heappop(heap)
+                if airport == destination and path:
+                    results.append(path)
+                    continue
+
+                if popped.get(airport, 0) >= limit or n > max_connections:
+                    continue
+                popped[airport] = popped.get(airport, 0) + 1
+
+                ready = arrival + min_connection if path else start
+                last = deadline if path else first_leg_end
+                visited = {origin}.union(leg.to_airport_id for leg in path)
+                departures = self._departures.get(airport, [])
+
+                for i in range(bisect_left(self._times.get(airport, []), ready), len(departures)):
+                    leg = departures[i]
+                    if leg.departing_at >= last:
+                        break
+                    if leg.to_airport_id in visited or leg.arriving_at > deadline:
+                        continue
+                    heapq.heappush(heap, (leg.arriving_at, n + 1, leg.to_airport_id, path + (leg,)))
+
+        return results
+
+
+route_graph = RouteGraph()
+
+
+def flight_changed(mapper, connection, target):
+    # doi ma chuyen bay thi bo ca cac chang cua ma cu
+    route_graph.mark_dirty(target.id, *inspect(target).attrs.id.history.deleted)
+
+
+def stop_changed(mapper, connection, target):
+    route_graph.mark_dirty(target.flight_id)
+
+
+def airline_changed(mapper, connection, target):
+    route_graph.invalidate()
+
+
+for name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Flight, name, flight_changed)
+    event.listen(Flight_AirportMedium, name, stop_changed)
+    event.listen(AirLine, name, airline_changed)
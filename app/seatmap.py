@@ -0,0 +1,117 @@
+import base64
+from collections import namedtuple
+from functools import lru_cache
+
+
+BUSINESS_COLUMNS = 'AC DF'
+ECONOMY_COLUMNS = 'ABC DEF'
+
+
+class CabinLayout(namedtuple('CabinLayout', ['rank', 'first_row', 'rows', 'columns', 'seats'])):
+    # ghe danh so theo hang: vi tri p -> hang first_row + p // width, cot letters[p % width]
+    # columns: chu cai cac cot, dau cach la loi di, vd 'ABC DEF'
+    @property
+    def letters(self):
+        return self.columns.replace(' ', '')
+
+    @property
+    def width(self):
+        return len(self.letters)
+
+    @property
+    def mask(self):
+        return (1 << self.seats) - 1
+
+    def seat_name(self, position):
+        return '%d%s' % (self.first_row + position // self.width, self.letters[position % self.width])
+
+    def blocks(self):
+        # [(cot dau, so cot)] cua tung day ghe giua cac loi di
+        result, start = [], 0
+        for group in self.columns.split():
+            result.append((start, len(group)))
+            start += len(group)
+        return result
+
+
+def default_layouts(total_seat):
+    # khoang 1/15 so ghe la hang thuong gia (4 ghe/hang), con lai pho thong (6 ghe/hang)
+    business_rows = total_seat // 60 * 2 if total_seat >= 60 else 0
+    business = business_rows * len(BUSINESS_COLUMNS.replace(' ', ''))
+    economy = total_seat - business
+    economy_width = len(ECONOMY_COLUMNS.replace(' ', ''))
+
+    layouts = []
+    if business:
+        layouts.append(CabinLayout(1, 1, business_rows, BUSINESS_COLUMNS, business))
+    if economy > 0:
+        layouts.append(CabinLayout(2, business_rows + 1, -(-economy // economy_width), ECONOMY_COLUMNS, economy))
+    return layouts
+
+
+@lru_cache(maxsize=256)
+def start_mask(layout, k, within_block=True):
+    # cac vi tri co the bat dau k ghe lien nhau tren cung hang (cung day ghe neu within_block)
+    spans = layout.blocks() if within_block else [(0, layout.width)]
+    mask = 0
+    for row in range(layout.rows):
+        for start, size in spans:
+            for col in range(start, start + size - k + 1):
+                p = row * layout.width + col
+                if p + k <= layout.seats:
+                    mask |= 1 << p
+    return mask
+
+
+def lowest_bits(value, k):
+    positions = []
+    while value and len(positions) < k:
+        low = value & -value
+        positions.append(low.bit_length() - 1)
+        value ^= low
+    return positions
+
+
+def find_seats(layout, taken, k):
+    # taken: so nguyen, bit p = 1 neu ghe p da co nguoi
+    # uu tien k ghe canh nhau cung day, roi cung hang, cuoi cung la k ghe trong bat ky
+    free = ~taken & layout.mask
+    if bin(free).count('1') < k:
+        return []
+
+    if 1 < k <= layout.width:
+        run = free
+        for i in range(1, k):
+            run &= free >> i
+        for within_block in (True, False):
+            candidates = run & start_mask(layout, k, within_block)
+            if candidates:
+                p = (candidates & -candidates).bit_length() - 1
+                return list(range(p, p + k))
+
+    return lowest_bits(free, k)
+
+
+def set_bits(value, positions):
+    for p in positions:
+        value |= 1 << p
+    return value
+
+
+def clear_bits(value, positions):
+    for p in positions:
+        value &= ~(1 << p)
+    return value
+
+
+def to_bytes(value, seats):
+    return value.to_bytes((seats + 7) // 8, 'little')
+
+
+def from_bytes(raw):
+    return int.from_bytes(raw, 'little') if raw else 0
+
+
+def encode(raw):
+    # bitmap gui cho trinh duyet: base64 cua cac byte little-endian
+    return base64.b64encode(raw or b'').decode('ascii')
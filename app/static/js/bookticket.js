@@ -1,26 +1,47 @@
-function filter_details_ticket() {
+let nextCursor = null
+
+function render_flights(data, append) {
     let h = ''
-    let str = document.getElementById('from').value
-    fetch("/api/search_booking")
-    .then(res => res.json())
-    .then(data => {
-        data.forEach((item, index) => {
-            if(item.airlines.name.toLowerCase().includes(str.toLowerCase())) {
-//            a=item.id.toString()
-                 console.log(item.id);
-                 h += `<tr>
-                    <td id="${index}" value="${item.name}">${item.airlines.name}</td>
-                    <td id="${index}" value="${item.plane_id}">${item.plane_id}</td>
-                    <td id="${index}" value="${item.departing_at}">${item.departing_at}</td>
-                    <td id="${index}" value="${item.arriving_at}">${item.arriving_at}</td>
-                    <td>
-                        <a href="/flight/${item.id}"
-                           class="block curser-pointer flex flex-nowrap btn-choose">Chọn</a>
-                    </td>
-                </tr>`
-            }
-        })
-        const address = document.getElementById('filter_flight')
-        address.innerHTML = h
+    data.flights.forEach((item, index) => {
+         h += `<tr>
+            <td id="${index}" value="${item.name}">${item.airlines.name}</td>
+            <td id="${index}" value="${item.plane_id}">${item.plane_id}</td>
+            <td id="${index}" value="${item.departing_at}">${item.departing_at}</td>
+            <td id="${index}" value="${item.arriving_at}">${item.arriving_at}</td>
+            <td id="${index}" value="${item.available}">${item.available}</td>
+            <td>
+                <a href="/flight/${item.id}"
+                   class="block curser-pointer flex flex-nowrap btn-choose">Chọn</a>
+            </td>
+        </tr>`
     })
-}
\ No newline at end of file
+    const address = document.getElementById('filter_flight')
+    if (append)
+        address.innerHTML += h
+    else
+        address.innerHTML = h
+
+    nextCursor = data.next_cursor
+    const more = document.getElementById('load_more')
+    if (more)
+        more.style.display = nextCursor ? 'inline-block' : 'none'
+}
+
+function fetch_flights(append) {
+    let params = new URLSearchParams()
+    params.set('kw', document.getElementById('from').value)
+    if (append && nextCursor)
+        params.set('cursor', nextCursor)
+
+    fetch("/api/search_booking?" + params.toString())
+    .then(res => res.json())
+    .then(data => render_flights(data, append))
+}
+
+function filter_details_ticket() {
+    fetch_flights(false)
+}
+
+function load_more_flights() {
+    fetch_flights(true)
+}
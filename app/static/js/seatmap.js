@@ -0,0 +1,38 @@
+function seat_taken(bytes, position) {
+    return (bytes[position >> 3] >> (position & 7)) & 1
+}
+
+function render_seat_map(cabins) {
+    let h = ''
+    cabins.forEach(cabin => {
+        const letters = cabin.columns.replace(/ /g, '')
+        const bytes = Uint8Array.from(atob(cabin.taken), c => c.charCodeAt(0))
+        h += `<h4>Hạng ${cabin.rank} - còn ${cabin.available}/${cabin.seats} ghế</h4><table class="seat-map">`
+        for (let r = 0; r < cabin.rows; r++) {
+            h += `<tr><td>${cabin.first_row + r}</td>`
+            let col = 0
+            for (const c of cabin.columns) {
+                if (c === ' ') {
+                    h += '<td class="aisle"></td>'
+                    continue
+                }
+                const p = r * letters.length + col++
+                if (p >= cabin.seats)
+                    h += '<td></td>'
+                else if (seat_taken(bytes, p))
+                    h += `<td class="seat taken">${c}</td>`
+                else
+                    h += `<td class="seat">${c}</td>`
+            }
+            h += '</tr>'
+        }
+        h += '</table>'
+    })
+    document.getElementById('seat_map').innerHTML = h
+}
+
+function load_seat_map(flightId) {
+    fetch(`/api/flight/${flightId}/seats`)
+    .then(res => res.json())
+    .then(data => render_seat_map(data))
+}
@@ -0,0 +1,206 @@
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import func, bindparam
+from app import db, dao, migrations
+from app.cache import response_cache
+from app.models import User, UserRole, AirPlane, AirPort, AirLine, Flight, Flight_AirportMedium, FA_Regulation, \
+    Seat, Profile, PlaneTicket, Regulation, flight_regulation, ticket_regulation
+from app.passwords import password_hasher
+from app.route_graph import route_graph
+
+
+# du lieu gia lap de do hieu nang; cung tham so + seed thi sinh ra cung du lieu
+REGULATIONS = [
+    ('book_time', '12:00:00', 'Thời gian đặt vé trước 12h lúc chuyến bay khởi hành'),
+    ('sale_time', '4:00:00', 'Thời gian bán vé trước 4h lúc chuyến bay khởi hành'),
+    ('1', '300000', 'Vé hạng 1 có đơn giá là 300.000 VND'),
+    ('2', '200000', 'Vé hạng 2 có đơn giá là 200.000 VND'),
+    ('duration', '00:30:00', 'Thời gian bay tối thiểu là 30 phút'),
+    ('min_stop', '00:20:00', 'Thời gian máy bay được dừng tối thiểu 20 phút'),
+    ('max_stop', '00:30:00', 'Thời gian máy bay được dừng tối đa 30 phút')
+]
+USERS = [
+    ('Quản trị', 'admin', UserRole.ADMIN),
+    ('Nhân viên', 'staff', UserRole.EMPLOYEE),
+    ('Khách hàng', 'customer', UserRole.USER)
+]
+PASSWORD = '1'
+# moi may bay bay lien tiep theo tung khung gio nen khong bao gio trung lich
+SLOT_HOURS = 6
+STOP_RATE = 0.3
+
+
+def default_size(flights):
+    # so san bay, tuyen bay, may bay tang theo so chuyen bay
+    return {
+        'airports': max(5, min(200, flights // 50)),
+        'airlines': max(5, min(2000, flights // 10)),
+        'planes': max(3, min(1000, flights // 20))
+    }
+
+
+def insert_users():
+    password = password_hasher.hash(PASSWORD)
+    db.session.execute(User.__table__.insert(), [{
+        'name': name, 'username': username, 'password': password, 'active': True,
+        'joined_date': datetime.now(), 'user_role': role
+    } for name, username, role in USERS])
+
+
+def insert_regulations():
+    db.session.execute(Regulation.__table__.insert(), [{'name': n, 'value': v, 'description': d}
+                                                        for n, v, d in REGULATIONS])
+    dao.regulation_cache.invalidate()
+
+
+def insert_network(rng, airports, airlines, planes):
+    db.session.execute(AirPort.__table__.insert(), [{'name': 'Sân bay %d' % i, 'location': 'Thành phố %d' % i}
+                                                     for i in range(1, airports + 1)])
+    airport_ids = [a for a, in db.session.query(AirPort.id).order_by(AirPort.id).all()]
+
+    routes = []
+    for i in range(1, airlines + 1):
+        a, b = rng.sample(airport_ids, 2)
+        routes.append({'id': 'T%d' % i, 'name': 'Tuyến %d' % i, 'from_airport_id': a, 'to_airport_id': b})
+    db.session.execute(AirLine.__table__.insert(), routes)
+
+    db.session.execute(AirPlane.__table__.insert(), [{
+        'id': 'MB%d' % i, 'name': 'Máy bay %d' % i, 'manufacturer': 'Gia lập',
+        'total_seat': rng.choice((60, 120, 180))
+    } for i in range(1, planes + 1)])
+    return airport_ids, routes
+
+
+def make_flights(rng, start, offset, count, planes, routes, airport_ids):
+    offsets = dao.sale_offsets()
+    duration_id = dao.regulation_cache.get_id('duration')
+    stop_ids = [i for i in (dao.regulation_cache.get_id('min_stop'), dao.regulation_cache.get_id('max_stop')) if i]
+
+    flights, stops, flight_regs, stop_regs = [], [], [], []
+    for n in range(offset, offset + count):
+        route = rng.choice(routes)
+        departing_at = start + timedelta(hours=SLOT_HOURS * (n // planes), minutes=rng.randrange(0, 60, 5))
+        arriving_at = departing_at + timedelta(minutes=rng.randrange(90, 300, 5))
+        flight = {'id': 'S%d' % (n + 1), 'name': 'Chuyến bay %d' % (n + 1),
+                  'departing_at': departing_at, 'arriving_at': arriving_at,
+                  'plane_id': 'MB%d' % (n % planes + 1), 'airline_id': route['id']}
+        flight.update(dao.sale_windows(departing_at, offsets))
+        flights.append(flight)
+        if duration_id:
+            flight_regs.append({'flight_id': flight['id'], 'regulation_id': duration_id})
+
+        others = [a for a in airport_ids if a not in (route['from_airport_id'], route['to_airport_id'])]
+        if others and rng.random() < STOP_RATE:
+            begin = departing_at + (arriving_at - departing_at) / 3
+            stop = {'name': 'Trạm dừng 1', 'stop_time_begin': begin,
+                    'stop_time_finish': begin + timedelta(minutes=25), 'description': None,
+                    'flight_id': flight['id'], 'airport_medium_id': rng.choice(others)}
+            stops.append(stop)
+            stop_regs.extend({'flight_id': flight['id'], 'airport_id': stop['airport_medium_id'],
+                              'regulation_id': r} for r in stop_ids)
+    return flights, stops, flight_regs, stop_regs
+
+
+def sell_tickets(rng, flights, quotas, user_id):
+    # ban quotas[flight_id] ghe ngau nhien cua moi chuyen bay, so do ghe duoc tinh lai sau do
+    seats = {}
+    for seat_id, flight_id, rank in db.session.query(Seat.id, Seat.flight_id, Seat.rank) \
+            .filter(Seat.flight_id.in_([f['id'] for f in flights])).order_by(Seat.id).all():
+        seats.setdefault(flight_id, []).append((seat_id, rank))
+
+    sold = []
+    for f in flights:
+        available = seats.get(f['id'], [])
+        for seat_id, rank in rng.sample(available, min(quotas.get(f['id'], 0), len(available))):
+            sold.append((f, seat_id, rank))
+    if not sold:
+        return 0
+
+    # chen theo thu tu nen khoa tu tang sau moc cu khop voi thu tu cac ve
+    last_serial = db.session.query(func.coalesce(func.max(Profile.serial), 0)).scalar()
+    db.session.execute(Profile.__table__.insert(), [{
+        'id': '%012d' % seat_id, 'name': 'Hành khách %d' % seat_id, 'gender': rng.choice(('nam', 'nu')),
+        'dob': datetime(1960, 1, 1) + timedelta(days=rng.randrange(0, 16000)),
+        'email': 'hk%d@example.com' % seat_id, 'phone': '09%08d' % (seat_id % 10 ** 8),
+        'isSupervisor': False, 'booking_code': 'G%d' % seat_id
+    } for f, seat_id, rank in sold])
+    serials = [s for s, in db.session.query(Profile.serial).filter(Profile.serial > last_serial)
+               .order_by(Profile.serial).all()]
+
+    airlines = dict(db.session.query(AirLine.id, AirLine.from_airport_id)
+                    .filter(AirLine.id.in_({f['airline_id'] for f in flights})).all())
+    last_ticket = db.session.query(func.coalesce(func.max(PlaneTicket.id), 0)).scalar()
+    db.session.execute(PlaneTicket.__table__.insert(), [{
+        'rank': rank, 'price': dao.get_rank_price(rank),
+        'date': f['departing_at'] - timedelta(days=rng.randrange(1, 60), minutes=rng.randrange(0, 1440)),
+        'booking_code': 'G%d' % seat_id, 'place': airlines[f['airline_id']], 'profile_id': serial,
+        'flight_id': f['id'], 'seat_id': seat_id, 'user_id': user_id
+    } for (f, seat_id, rank), serial in zip(sold, serials)])
+    db.session.execute(ticket_regulation.insert(), [{
+        'ticket_id': ticket_id, 'regulation_id': dao.regulation_cache.get_id(str(rank))
+    } for ticket_id, rank in db.session.query(PlaneTicket.id, PlaneTicket.rank)
+        .filter(PlaneTicket.id > last_ticket).all()])
+    db.session.execute(Seat.__table__.update().where(Seat.id.__eq__(bindparam('sold_id'))).values(status=True),
+                       [{'sold_id': seat_id} for f, seat_id, rank in sold])
+    return len(sold)
+
+
+def generate(flights=1000, tickets=5000, airports=None, airlines=None, planes=None, seed=0, start=None,
+             batch_size=1000, reset=True):
+    # xoa va tao lai CSDL dang cau hinh roi chen du lieu theo lo; tra ve so dong da tao
+    size = default_size(flights)
+    airports = airports or size['airports']
+    airlines = airlines or size['airlines']
+    planes = planes or size['planes']
+    start = start or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=2)
+    rng = random.Random(seed)
+
+    if reset:
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        # bang moi da dung so do hien tai, chi ghi nhan phien ban
+        migrations.upgrade()
+    dao.user_cache.invalidate()
+    insert_regulations()
+    insert_users()
+    airport_ids, routes = insert_network(rng, airports, airlines, planes)
+    db.session.commit()
+    user_id = db.session.query(User.id).filter(User.username.__eq__('customer')).scalar()
+
+    # chia deu so ve cho cac chuyen bay, phan du chia ngau nhien
+    quotas = [tickets // flights] * flights if flights else []
+    for i in rng.sample(range(flights), tickets % flights if flights else 0):
+        quotas[i] += 1
+
+    sold = stops_total = 0
+    for offset in range(0, flights, batch_size):
+        count = min(batch_size, flights - offset)
+        batch, stops, flight_regs, stop_regs = make_flights(rng, start, offset, count, planes, routes, airport_ids)
+        db.session.execute(Flight.__table__.insert(), batch)
+        if flight_regs:
+            db.session.execute(flight_regulation.insert(), flight_regs)
+        if stops:
+            db.session.execute(Flight_AirportMedium.__table__.insert(), stops)
+            if stop_regs:
+                db.session.execute(FA_Regulation.__table__.insert(), stop_regs)
+        ids = [f['id'] for f in batch]
+        dao.build_seat_maps(db.session, ids)
+        sold += sell_tickets(rng, batch, {f['id']: quotas[offset + i] for i, f in enumerate(batch)}, user_id)
+        # tinh lai so ghe da ban va bitmap sau khi danh dau ghe
+        dao.build_seat_maps(db.session, ids)
+        db.session.commit()
+        stops_total += len(stops)
+
+    dao.rebuild_revenue_rollup()
+    route_graph.invalidate()
+    response_cache.invalidate('flights', 'airports')
+    return {
+        'airports': airports,
+        'airlines': airlines,
+        'planes': planes,
+        'flights': flights,
+        'stops': stops_total,
+        'tickets': sold,
+        'seed': seed
+    }
@@ -0,0 +1,25 @@
+import os
+import tempfile
+import pytest
+
+# chay tren sqlite tam, khong dung CSDL MySQL that
+os.environ['DB_ENGINE'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='qlcb-test-'), 'test.db')
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('DATABASE_REPLICA_URL', None)
+
+from app import app as flask_app, db, synthetic, index  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config.update(TESTING=True, HOLD_SWEEP_INTERVAL=0)
+    with flask_app.app_context():
+        synthetic.generate(flights=40, tickets=120, seed=1)
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,123 @@
+import threading
+from decimal import Decimal
+from app import db, dao
+from app.models import FlightAvailability, Regulation, Seat, User
+
+
+def run_threads(app, count, target):
+    errors = []
+
+    def run(n):
+        with app.app_context():
+            try:
+                target(n)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_concurrent_claims_never_share_a_seat(app):
+    flight_id, free = db.session.query(FlightAvailability.flight_id,
+                                       db.func.sum(FlightAvailability.capacity - FlightAvailability.sold)) \
+        .group_by(FlightAvailability.flight_id) \
+        .order_by(db.func.sum(FlightAvailability.capacity - FlightAvailability.sold).desc()).first()
+    db.session.remove()
+    # dat nhieu hon so ghe trong de thu ca truong hop het ghe
+    threads, per_thread = 20, (free + 40) // 20 + 1
+    claimed, lock = [], threading.Lock()
+
+    def book(n):
+        for i in range(per_thread):
+            ids = [s.id for s in dao.claim_seats(flight_id, 1)]
+            with lock:
+                claimed.extend(ids)
+            db.session.remove()
+
+    run_threads(app, threads, book)
+
+    assert len(claimed) == len(set(claimed))
+    assert len(claimed) <= free
+    sold = db.session.query(db.func.count(Seat.id)).filter(Seat.id.in_(claimed), Seat.status.__eq__(True)).scalar()
+    assert sold == len(claimed)
+    assert dao.remaining_seats(flight_id) == free - len(claimed)
+    assert dao.reconcile_availability([flight_id]) == []
+
+
+def test_regulation_cache_never_serves_a_value_older_than_the_last_invalidation(app):
+    regulation_id = dao.regulation_cache.get_id('1')
+    published = {'version': 0}
+    stale = []
+    done = threading.Event()
+
+    def write(n):
+        for version in range(1, 41):
+            Regulation.query.get(regulation_id).value = str(300000 + version)
+            db.session.commit()
+            dao.regulation_cache.invalidate()
+            published['version'] = version
+        done.set()
+
+    def read(n):
+        while not done.is_set():
+            expected = published['version']
+            value = dao.regulation_cache.get_by_name('1')
+            db.session.rollback()
+            if value < Decimal(300000 + expected):
+                stale.append((expected, value))
+
+    run_threads(app, 9, lambda n: write(n) if n == 0 else read(n))
+
+    assert stale == []
+    assert dao.regulation_cache.get_by_name('1') == Decimal(300040)
+    assert dao.regulation_cache.stats()['misses'] >= 40
+
+
+def test_user_cache_never_serves_a_name_older_than_the_last_commit(app):
+    user_id = db.session.query(User.id).filter(User.username.__eq__('customer')).scalar()
+    db.session.remove()
+    published = {'version': 0}
+    stale = []
+    done = threading.Event()
+
+    def write(n):
+        for version in range(1, 41):
+            User.query.get(user_id).name = 'Khách %03d' % version
+            db.session.commit()
+            published['version'] = version
+        done.set()
+
+    def read(n):
+        while not done.is_set():
+            expected = 'Khách %03d' % published['version']
+            user = dao.get_user_by_id(user_id)
+            db.session.rollback()
+            if published['version'] and user.name < expected:
+                stale.append((expected, user.name))
+
+    run_threads(app, 9, lambda n: write(n) if n == 0 else read(n))
+
+    assert stale == []
+    assert dao.get_user_by_id(user_id).name == 'Khách 040'
+    assert dao.user_cache.stats()['invalidations'] >= 40
+
+
+def test_user_cache_evicts_least_recently_used(app):
+    cache = dao.UserCache(ttl=60, max_size=2)
+    ids = [i for i, in db.session.query(User.id).order_by(User.id).all()]
+
+    for user_id in ids:
+        cache.get(user_id)
+    cache.get(ids[1])
+    cache.get(ids[0])
+
+    assert cache.stats()['size'] == 2
+    assert cache.stats()['misses'] == 4
+    assert cache.stats()['hits'] == 1
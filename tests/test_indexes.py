@@ -0,0 +1,30 @@
+from datetime import datetime
+from app import db, dao
+from app.models import Flight
+
+
+def query_plan(query):
+    sql = str(query.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    return ' | '.join(row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql)))
+
+
+def test_search_by_route_uses_route_indexes(app):
+    plan = query_plan(dao.search_flights_statement(from_airport_id=1, to_airport_id=2))
+
+    assert 'ix_airlines_route' in plan
+    assert 'ix_flights_airline_departing' in plan
+
+
+def test_keyset_page_uses_departing_index(app):
+    first = db.session.query(Flight).order_by(Flight.departing_at, Flight.id).first()
+    plan = query_plan(dao.search_flights_statement(cursor=dao.encode_cursor(first)))
+
+    assert 'ix_flights_departing' in plan
+    assert 'SCAN flights' not in plan
+
+
+def test_date_range_uses_departing_index(app):
+    plan = query_plan(dao.search_flights_statement(date_from=datetime.now().date(),
+                                                   date_to=datetime.now().date()))
+
+    assert 'ix_flights_departing' in plan